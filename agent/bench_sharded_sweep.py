@@ -0,0 +1,63 @@
+# tools/bench_sharded_sweep.py
+"""Scaling benchmark for the sharded sweep against the local API stand-in.
+
+Runs the rule-based ("direct") sweep with 1..N worker processes and prints
+wall time and throughput for each. Usage:
+
+    python bench_sharded_sweep.py --customers 500 --latency 0.02 --max-workers 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from local_api import LocalInvoiceAPI
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded sweep scaling benchmark")
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--invoices-per-customer", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every API call")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    api = LocalInvoiceAPI(
+        latency=args.latency,
+        num_customers=args.customers,
+        invoices_per_customer=args.invoices_per_customer
+    ).start()
+    # Must be set before invoice_tools is imported, here and in the spawned workers
+    os.environ["API_BASE_URL"] = api.base_url
+    snapshot_path = os.path.join(tempfile.mkdtemp(prefix="abi-bench-"), "ledger.snap")
+    os.environ["LEDGER_SNAPSHOT_PATH"] = snapshot_path
+    from sharded_sweep import run_sharded_sweep
+
+    worker_counts = []
+    workers = 1
+    while workers < args.max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(args.max_workers)
+
+    print(f"{'workers':>7} {'seconds':>8} {'invoices':>8} {'inv/s':>8} {'speedup':>8} {'errors':>6}")
+    baseline = None
+    try:
+        for workers in worker_counts:
+            api.reset()
+            # Every run starts cold, without the previous run's email_sent flags
+            if os.path.exists(snapshot_path):
+                os.unlink(snapshot_path)
+            start = time.perf_counter()
+            summary = run_sharded_sweep(workers=workers, mode="direct")
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{workers:>7} {elapsed:>8.2f} {summary['processed']:>8} "
+                  f"{summary['processed'] / elapsed:>8.1f} {baseline / elapsed:>7.2f}x "
+                  f"{len(summary['errors']):>6}")
+    finally:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
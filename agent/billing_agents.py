@@ -1,6 +1,5 @@
 # billing_agent.py
 from strands import Agent, tool
-from strands.models import BedrockModel
 from invoice_tools import (
     get_invoice_details, 
     list_all_invoices,
@@ -10,9 +9,12 @@ from invoice_tools import (
     send_personalized_email,
     get_customer_id_from_invoice
 )
+from payment_scoring import score_payment_propensity
+from plan_cache import run_with_plan_cache
+from resilience import GuardedBedrockModel
 
 # Create Bedrock model
-bedrock_model = BedrockModel(
+bedrock_model = GuardedBedrockModel(
     model_id="us.amazon.nova-pro-v1:0",
     temperature=0.1
 )
@@ -113,6 +115,10 @@ get_overdue_invoices()
 Returns: All overdue invoices with customer details
 Use when: You need overdue analysis
 
+score_payment_propensity(customer_id: Optional[str], limit: int)
+Returns: Payment probability, predicted pay date and risk level from a model scored over the whole ledger; per customer if customer_id is given, otherwise the open invoices least likely to be paid
+Use when: You need to prioritize collections or forecast when invoices will be paid
+
 IMPORTANT: Use get_invoice_details first to get customer_id, then get_customer_invoice_history. Don't use get_customer_id_from_invoice - it's redundant.
 """
 
@@ -186,37 +192,40 @@ Always explain your workflow and which agents you're using for each task.
 
 # Base model configuration
 def create_base_model():
-    return BedrockModel(
+    return GuardedBedrockModel(
         model_id="us.amazon.nova-lite-v1:0",
         temperature=0.3
     )
 
 # Email Agent
+EMAIL_AGENT_TOOLS = [send_personalized_email, get_customer_invoice_history, get_invoice_details]
 email_agent = Agent(
     model=create_base_model(),
     system_prompt=EMAIL_AGENT_PROMPT,
-    tools=[send_personalized_email, get_customer_invoice_history, get_invoice_details]
+    tools=EMAIL_AGENT_TOOLS
 )
 
 # Analysis Agent  
+ANALYSIS_AGENT_TOOLS = [get_customer_invoice_history, list_all_invoices, get_overdue_invoices, get_customer_id_from_invoice, get_invoice_details, score_payment_propensity]
 analysis_agent = Agent(
     model=create_base_model(),
     system_prompt=ANALYSIS_AGENT_PROMPT,
-    tools=[get_customer_invoice_history, list_all_invoices, get_overdue_invoices, get_customer_id_from_invoice, get_invoice_details]
+    tools=ANALYSIS_AGENT_TOOLS
 )
 
 # Invoice Agent
+INVOICE_AGENT_TOOLS = [get_invoice_details, update_invoice_status, list_all_invoices]
 invoice_agent = Agent(
     model=create_base_model(),
     system_prompt=INVOICE_AGENT_PROMPT,
-    tools=[get_invoice_details, update_invoice_status, list_all_invoices]
+    tools=INVOICE_AGENT_TOOLS
 )
 
 @tool
 def call_analysis_agent(task: str) -> dict:
     """Call the Analysis Agent to analyze customer data"""
     try:
-        response = analysis_agent(task)
+        response = run_with_plan_cache(analysis_agent, task, ANALYSIS_AGENT_TOOLS)
         return {
             "success": True,
             "agent": "AnalysisAgent",
@@ -232,7 +241,7 @@ def call_analysis_agent(task: str) -> dict:
 def call_email_agent(task: str) -> dict:
     """Call the Email Agent to send personalized emails"""
     try:
-        response = email_agent(task)
+        response = run_with_plan_cache(email_agent, task, EMAIL_AGENT_TOOLS)
         return {
             "success": True,
             "agent": "EmailAgent", 
@@ -248,7 +257,7 @@ def call_email_agent(task: str) -> dict:
 def call_invoice_agent(task: str) -> dict:
     """Call the Invoice Agent to manage invoice operations"""
     try:
-        response = invoice_agent(task)
+        response = run_with_plan_cache(invoice_agent, task, INVOICE_AGENT_TOOLS)
         return {
             "success": True,
             "agent": "InvoiceAgent",
@@ -308,6 +317,10 @@ INVOICE STATUS DEFINITIONS:
 - Returns: Customer ID and basic info from invoice
 - Use when: Have invoice ID but need customer ID
 
+**score_payment_propensity(customer_id: Optional[str], limit: int)**
+- Returns: Payment probability and predicted pay date for open invoices, scored over the whole ledger
+- Use when: Need to prioritize follow-ups or forecast collections
+
 ## EMAIL AUTOMATION WORKFLOW:
 
 When processing invoices for automated emails:
@@ -353,23 +366,26 @@ For automation tasks, always provide:
 
 Execute tasks efficiently while maintaining professional customer relationships and ensuring accurate record keeping.
 """
+UNIFIED_AGENT_TOOLS = [
+    get_invoice_details,
+    list_all_invoices, 
+    get_customer_invoice_history,
+    send_personalized_email,
+    update_invoice_status,
+    get_customer_id_from_invoice,
+    score_payment_propensity
+]
 unified_billing_agent = Agent(
-    model=BedrockModel(model_id="us.amazon.nova-lite-v1:0", temperature=0.1),
+    model=GuardedBedrockModel(model_id="us.amazon.nova-lite-v1:0", temperature=0.1),
     system_prompt=UNIFIED_BILLING_AGENT_PROMPT,
-    tools=[
-        get_invoice_details,
-        list_all_invoices, 
-        get_customer_invoice_history,
-        send_personalized_email,
-        update_invoice_status,
-        get_customer_id_from_invoice
-    ]
+    tools=UNIFIED_AGENT_TOOLS
 )
 
 # Test scenarios
 if __name__ == "__main__":
     print("Testing Billing Agent with Your Lambda Functions\n")
-    response = unified_billing_agent("""
+    # Nightly sweep: after the first successful run the recorded lookups are prefetched
+    response = run_with_plan_cache(unified_billing_agent, """
     Process all invoices with status "sent" and send emails based on these rules:
     RULES:
 
@@ -385,5 +401,5 @@ if __name__ == "__main__":
     Report summary: total processed, emails sent, skipped, errors
 
     NOTE: DO NOT UPDATE INVOICE STATUS, ONLY SEND EMAILS
-    """)
+    """, UNIFIED_AGENT_TOOLS)
     print("Invoice Agent Response:\n", response, "\n")
\ No newline at end of file
@@ -2,25 +2,38 @@
 from strands import tool
 import boto3
 import json
+import os
 import requests
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
+from resilience import api_gateway, email_gateway, is_overloaded_response
+from ledger_snapshot import ledger_cache, snapshot_path_for
 
 # Initialize AWS Lambda client
 lambda_client = boto3.client('lambda', region_name='us-east-1')
 
-# Your API Gateway base URL
-API_BASE_URL = "https://1epz8gbc84.execute-api.ap-southeast-5.amazonaws.com/dev"
+# Your API Gateway base URL (override with API_BASE_URL to target the local stand-in)
+API_BASE_URL = os.environ.get(
+    "API_BASE_URL", "https://1epz8gbc84.execute-api.ap-southeast-5.amazonaws.com/dev"
+)
+
+# Keep-alive connection pool, one per process
+http = requests.Session()
+http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+http.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
 
 @tool
 def get_invoice_details(invoice_id: str) -> dict:
     """Get detailed information about a specific invoice including payment status and overdue calculations"""
     
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/invoices/{invoice_id}",
-            headers={"Content-Type": "application/json"},
-            timeout=30
+        response = api_gateway.call(
+            lambda: http.get(
+                f"{API_BASE_URL}/invoices/{invoice_id}",
+                headers={"Content-Type": "application/json"},
+                timeout=30
+            ),
+            is_overloaded=is_overloaded_response
         )
         
         if response.status_code == 200:
@@ -61,58 +74,96 @@ def get_invoice_details(invoice_id: str) -> dict:
             "error": f"Error getting invoice: {str(e)}"
         }
 
+def _request_invoices(status_filter: Optional[str] = None):
+    url = f"{API_BASE_URL}/invoices"
+    if status_filter:
+        url += f"?status={status_filter}"
+    return api_gateway.call(
+        lambda: http.get(
+            url,
+            headers={"Content-Type": "application/json"},
+            timeout=30
+        ),
+        is_overloaded=is_overloaded_response
+    )
+
+def _process_invoices(raw_invoices: list) -> list:
+    processed_invoices = []
+    for invoice in raw_invoices:
+        processed_invoices.append({
+            "invoice_id": invoice["invoiceId"],
+            "customer_id": invoice["customerId"],
+            "deal_id": invoice.get("dealId"),
+            "customer_name": invoice["name"],
+            "customer_email": invoice["email"],
+            "company_name": invoice["companyName"],
+            "amount": invoice["amount"],
+            "currency": invoice.get("currency", "MYR"),
+            "status": invoice["status"],
+            "due_date": invoice["dueDate"],
+            "created_at": invoice["createdAt"],
+            "is_overdue": invoice.get("isOverdue", False),
+            "days_overdue": invoice.get("daysOverdue", 0),
+            "email_sent": invoice.get("emailSent", False),
+            "payment_terms": invoice.get("paymentTerms")
+        })
+    return processed_invoices
+
+def _fetch_ledger(status_filter: Optional[str] = None) -> tuple:
+    """Ledger from the API with the API's own summary; unfiltered, it feeds the snapshot cache"""
+    response = _request_invoices(status_filter)
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to list invoices: {response.text}")
+    result = response.json()
+    return _process_invoices(result["invoices"]), result["summary"]
+
+ledger_cache.path = snapshot_path_for(API_BASE_URL)
+ledger_cache.fetch = _fetch_ledger
+
+def _filtered_summary(snapshot, invoices: list) -> Optional[dict]:
+    """The full listing's summary keys recounted over a filtered listing.
+
+    Only keys that can be recounted from the rows are supported: "total", each
+    status value and "overdue". None if the API's summary has any other key.
+    """
+    counts = {
+        "total": len(invoices),
+        "overdue": sum(1 for inv in invoices if inv["is_overdue"])
+    }
+    for status in snapshot.dictionary("status"):
+        counts[status] = sum(1 for inv in invoices if inv["status"] == status)
+    if not set(snapshot.summary) <= set(counts):
+        return None
+    return {key: counts[key] for key in snapshot.summary}
+
 @tool
 def list_all_invoices(status_filter: Optional[str] = None) -> dict:
     """Get list of all invoices, optionally filtered by status (sent, paid)"""
     
     try:
-        url = f"{API_BASE_URL}/invoices"
-        if status_filter:
-            url += f"?status={status_filter}"
+        snapshot = ledger_cache.get()
+        summary = None
+        if snapshot is not None:
+            processed_invoices = snapshot.rows(status=status_filter)
+            summary = _filtered_summary(snapshot, processed_invoices) if status_filter else snapshot.summary
+        if summary is None:
+            if status_filter:
+                # Only the API knows its filtered summary; refresh the snapshot alongside
+                processed_invoices, summary = _fetch_ledger(status_filter)
+                ledger_cache.refresh_async()
+            else:
+                # One full download serves this call and refreshes the snapshot
+                processed_invoices, summary = ledger_cache.load()
             
-        response = requests.get(
-            url,
-            headers={"Content-Type": "application/json"},
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            processed_invoices = []
-            for invoice in result["invoices"]:
-                processed_invoices.append({
-                    "invoice_id": invoice["invoiceId"],
-                    "customer_id": invoice["customerId"],
-                    "deal_id": invoice.get("dealId"),
-                    "customer_name": invoice["name"],
-                    "customer_email": invoice["email"],
-                    "company_name": invoice["companyName"],
-                    "amount": invoice["amount"],
-                    "currency": invoice.get("currency", "MYR"),
-                    "status": invoice["status"],
-                    "due_date": invoice["dueDate"],
-                    "created_at": invoice["createdAt"],
-                    "is_overdue": invoice.get("isOverdue", False),
-                    "days_overdue": invoice.get("daysOverdue", 0),
-                    "email_sent": invoice.get("emailSent", False),
-                    "payment_terms": invoice.get("paymentTerms")
-                })
-            
-            return {
-                "success": True,
-                "summary": result["summary"],
-                "total_invoices": len(processed_invoices),
-                "overdue_invoices": [inv for inv in processed_invoices if inv["is_overdue"]],
-                "sent_invoices": [inv for inv in processed_invoices if inv["status"] == "sent"],
-                "paid_invoices": [inv for inv in processed_invoices if inv["status"] == "paid"],
-                "all_invoices": processed_invoices
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Failed to list invoices: {response.text}"
-            }
+        return {
+            "success": True,
+            "summary": summary,
+            "total_invoices": len(processed_invoices),
+            "overdue_invoices": [inv for inv in processed_invoices if inv["is_overdue"]],
+            "sent_invoices": [inv for inv in processed_invoices if inv["status"] == "sent"],
+            "paid_invoices": [inv for inv in processed_invoices if inv["status"] == "paid"],
+            "all_invoices": processed_invoices
+        }
             
     except Exception as e:
         return {
@@ -168,14 +219,18 @@ def update_invoice_status(invoice_id: str) -> dict:
     try:
         # Make PUT request to /invoices/{invoice_id} endpoint
         # The invoice_id goes in the URL path, no body needed
-        response = requests.put(
-            f"{API_BASE_URL}/invoices/{invoice_id}",  # invoice_id in path
-            headers={"Content-Type": "application/json"},
-            timeout=30
+        response = api_gateway.call(
+            lambda: http.put(
+                f"{API_BASE_URL}/invoices/{invoice_id}",  # invoice_id in path
+                headers={"Content-Type": "application/json"},
+                timeout=30
+            ),
+            is_overloaded=is_overloaded_response
         )
         
         if response.status_code == 200:
             result = response.json()
+            ledger_cache.invalidate()
             return {
                 "success": True,
                 "invoice_id": invoice_id,
@@ -198,74 +253,83 @@ def update_invoice_status(invoice_id: str) -> dict:
             "error": f"Error marking invoice as paid: {str(e)}"
         }
 
+def customer_history_from(customer_id: str, customer_invoices: list) -> dict:
+    """Payment-pattern summary over one customer's invoices"""
+    if not customer_invoices:
+        return {
+            "success": True,
+            "customer_id": customer_id,
+            "total_invoices": 0,
+            "message": "No invoices found for this customer"
+        }
+    
+    # Analyze payment patterns
+    total_invoices = len(customer_invoices)
+    paid_invoices = [inv for inv in customer_invoices if inv["status"] == "paid"]
+    sent_invoices = [inv for inv in customer_invoices if inv["status"] == "sent"]
+    overdue_invoices = [inv for inv in customer_invoices if inv["is_overdue"]]
+    
+    total_amount = sum(inv["amount"] for inv in customer_invoices)
+    paid_amount = sum(inv["amount"] for inv in paid_invoices)
+    overdue_amount = sum(inv["amount"] for inv in overdue_invoices)
+    
+    # Calculate payment rate
+    payment_rate = len(paid_invoices) / total_invoices if total_invoices > 0 else 0
+    
+    # Determine risk level
+    if payment_rate >= 0.9:
+        risk_level = "LOW"
+    elif payment_rate >= 0.7:
+        risk_level = "MEDIUM"
+    else:
+        risk_level = "HIGH"
+    
+    # Get customer details from first invoice
+    customer_info = customer_invoices[0]
+    
+    return {
+        "success": True,
+        "customer_id": customer_id,
+        "customer_name": customer_info["customer_name"],
+        "customer_email": customer_info["customer_email"],
+        "company_name": customer_info["company_name"],
+        "total_invoices": total_invoices,
+        "paid_invoices": len(paid_invoices),
+        "sent_invoices": len(sent_invoices),
+        "overdue_invoices": len(overdue_invoices),
+        "total_amount": total_amount,
+        "paid_amount": paid_amount,
+        "overdue_amount": overdue_amount,
+        "payment_rate": payment_rate,
+        "risk_level": risk_level,
+        "currency": customer_info.get("currency", "MYR"),
+        "language": customer_info.get("language", "en"),
+        "timezone": customer_info.get("timezone", "Asia/Kuala_Lumpur"),
+        "invoices": customer_invoices
+    }
+
 @tool 
 def get_customer_invoice_history(customer_id: str) -> dict:
     """Get all invoices for a specific customer to analyze payment patterns"""
     
     try:
-        # Get all invoices and filter by customer
-        all_invoices = list_all_invoices()
-        
-        if not all_invoices["success"]:
-            return all_invoices
-        
-        customer_invoices = [
-            inv for inv in all_invoices["all_invoices"] 
-            if inv["customer_id"] == customer_id
-        ]
-        
-        if not customer_invoices:
-            return {
-                "success": True,
-                "customer_id": customer_id,
-                "total_invoices": 0,
-                "message": "No invoices found for this customer"
-            }
-        
-        # Analyze payment patterns
-        total_invoices = len(customer_invoices)
-        paid_invoices = [inv for inv in customer_invoices if inv["status"] == "paid"]
-        sent_invoices = [inv for inv in customer_invoices if inv["status"] == "sent"]
-        overdue_invoices = [inv for inv in customer_invoices if inv["is_overdue"]]
-        
-        total_amount = sum(inv["amount"] for inv in customer_invoices)
-        paid_amount = sum(inv["amount"] for inv in paid_invoices)
-        overdue_amount = sum(inv["amount"] for inv in overdue_invoices)
-        
-        # Calculate payment rate
-        payment_rate = len(paid_invoices) / total_invoices if total_invoices > 0 else 0
-        
-        # Determine risk level
-        if payment_rate >= 0.9:
-            risk_level = "LOW"
-        elif payment_rate >= 0.7:
-            risk_level = "MEDIUM"
+        snapshot = ledger_cache.get()
+        if snapshot is not None:
+            # Filter on the encoded customer_id column, no full materialization
+            customer_invoices = snapshot.rows(customer_id=customer_id)
         else:
-            risk_level = "HIGH"
-        
-        # Get customer details from first invoice
-        customer_info = customer_invoices[0]
+            # Get all invoices and filter by customer
+            all_invoices = list_all_invoices()
+            
+            if not all_invoices["success"]:
+                return all_invoices
+            
+            customer_invoices = [
+                inv for inv in all_invoices["all_invoices"] 
+                if inv["customer_id"] == customer_id
+            ]
         
-        return {
-            "success": True,
-            "customer_id": customer_id,
-            "customer_name": customer_info["customer_name"],
-            "customer_email": customer_info["customer_email"],
-            "company_name": customer_info["company_name"],
-            "total_invoices": total_invoices,
-            "paid_invoices": len(paid_invoices),
-            "sent_invoices": len(sent_invoices),
-            "overdue_invoices": len(overdue_invoices),
-            "total_amount": total_amount,
-            "paid_amount": paid_amount,
-            "overdue_amount": overdue_amount,
-            "payment_rate": payment_rate,
-            "risk_level": risk_level,
-            "currency": customer_info.get("currency", "MYR"),
-            "language": customer_info.get("language", "en"),
-            "timezone": customer_info.get("timezone", "Asia/Kuala_Lumpur"),
-            "invoices": customer_invoices
-        }
+        return customer_history_from(customer_id, customer_invoices)
         
     except Exception as e:
         return {
@@ -328,17 +392,19 @@ def send_personalized_email(customer_name: str,
     
     # Call API Gateway endpoint
     try:
-        import requests
-        
-        response = requests.post(
-            f"{API_BASE_URL}/send-email",
-            headers={"Content-Type": "application/json"},
-            json=payload,
-            timeout=30
+        response = email_gateway.call(
+            lambda: http.post(
+                f"{API_BASE_URL}/send-email",
+                headers={"Content-Type": "application/json"},
+                json=payload,
+                timeout=30
+            ),
+            is_overloaded=is_overloaded_response
         )
         
         if response.status_code == 200:
             result = response.json()
+            ledger_cache.mark_email_sent(invoice_number)
             return {
                 "success": True,
                 "message": f"Personalized {tone} email sent to {customer_name}",
@@ -0,0 +1,152 @@
+# tools/local_api.py
+"""Local stand-in for the invoice API Gateway, for benchmarks and offline runs.
+
+Serves the same routes and payload shapes as the deployed Lambdas:
+GET /invoices[?status=], GET /invoices/{id}, PUT /invoices/{id}, POST /send-email.
+"""
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def generate_invoices(num_customers: int = 200, invoices_per_customer: int = 5, seed: int = 7) -> dict:
+    """Build a deterministic ledger keyed by invoiceId"""
+    rng = random.Random(seed)
+    today = datetime.now()
+    invoices = {}
+    for c in range(num_customers):
+        customer_id = f"CUST-{c:06d}"
+        # Per-customer habit, so payment behaviour is learnable from history
+        reliability = rng.betavariate(4, 2)
+        for i in range(invoices_per_customer):
+            invoice_id = f"INV-{c:06d}-{i:03d}"
+            created = today - timedelta(days=rng.randint(0, 120))
+            due = created + timedelta(days=30)
+            status = "paid" if rng.random() < reliability else "sent"
+            days_overdue = max(0, (today - due).days) if status == "sent" else 0
+            invoices[invoice_id] = {
+                "invoiceId": invoice_id,
+                "customerId": customer_id,
+                "dealId": f"DEAL-{c:06d}-{i:03d}",
+                "name": f"Customer {c}",
+                "email": f"customer{c}@example.com",
+                "companyName": f"Company {c}",
+                "amount": round(rng.uniform(100, 5000), 2),
+                "currency": "MYR",
+                "status": status,
+                "dueDate": due.strftime("%Y-%m-%d"),
+                "createdAt": created.isoformat(),
+                "isOverdue": days_overdue > 0,
+                "daysOverdue": days_overdue,
+                "emailSent": rng.random() < 0.5,
+                "paymentTerms": "Net 30"
+            }
+    return invoices
+
+
+class LocalInvoiceAPI:
+    """In-process HTTP server with a configurable per-request latency"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.02, **ledger_kwargs):
+        self.latency = latency
+        self.ledger_kwargs = ledger_kwargs
+        self.lock = threading.Lock()
+        self.reset()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset(self) -> None:
+        with self.lock:
+            self.invoices = generate_invoices(**self.ledger_kwargs)
+
+    def start(self) -> "LocalInvoiceAPI":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: dict) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _invoice_id(self, path: str):
+                parts = path.strip("/").split("/")
+                return parts[1] if len(parts) == 2 and parts[0] == "invoices" else None
+
+            def do_GET(self):
+                time.sleep(api.latency)
+                url = urlparse(self.path)
+                if url.path.rstrip("/") == "/invoices":
+                    status = parse_qs(url.query).get("status", [None])[0]
+                    with api.lock:
+                        rows = [dict(inv) for inv in api.invoices.values()
+                                if status is None or inv["status"] == status]
+                    summary = {
+                        "total": len(rows),
+                        "sent": sum(1 for inv in rows if inv["status"] == "sent"),
+                        "paid": sum(1 for inv in rows if inv["status"] == "paid"),
+                        "overdue": sum(1 for inv in rows if inv["isOverdue"])
+                    }
+                    return self._send(200, {"invoices": rows, "summary": summary})
+                invoice_id = self._invoice_id(url.path)
+                with api.lock:
+                    invoice = dict(api.invoices[invoice_id]) if invoice_id in api.invoices else None
+                if invoice is None:
+                    return self._send(404, {"error": "Invoice not found"})
+                return self._send(200, {"invoice": invoice})
+
+            def do_PUT(self):
+                time.sleep(api.latency)
+                invoice_id = self._invoice_id(urlparse(self.path).path)
+                with api.lock:
+                    invoice = api.invoices.get(invoice_id)
+                    if invoice is not None:
+                        invoice.update(status="paid", isOverdue=False, daysOverdue=0)
+                        invoice = dict(invoice)
+                if invoice is None:
+                    return self._send(404, {"error": "Invoice not found"})
+                return self._send(200, {"message": f"Invoice {invoice_id} marked as paid", "invoice": invoice})
+
+            def do_POST(self):
+                time.sleep(api.latency)
+                if urlparse(self.path).path.rstrip("/") != "/send-email":
+                    return self._send(404, {"error": "Not found"})
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with api.lock:
+                    invoice = api.invoices.get(payload.get("invoice_number"))
+                    if invoice is not None:
+                        invoice["emailSent"] = True
+                return self._send(200, {"message": "Email sent", "invoice_number": payload.get("invoice_number")})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    api = LocalInvoiceAPI(port=8787)
+    print(f"Local invoice API listening on {api.base_url}")
+    api.server.serve_forever()
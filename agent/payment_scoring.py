@@ -0,0 +1,374 @@
+# tools/payment_scoring.py
+"""Batch payment-propensity scoring over the whole ledger.
+
+Every customer's features are computed in a handful of vectorized NumPy passes
+(bincount group-bys over integer customer codes), a small L2-regularised
+logistic regression is fitted on invoices with a known outcome (paid vs. sent
+and overdue), and every open invoice gets a payment probability and a
+predicted pay date. When the ledger snapshot is mapped, numeric columns and
+dictionary codes are read straight from it without building row dicts.
+
+The ledger has no payment timestamps, so lateness is taken from the current
+days_overdue of open invoices and the "last payment" is the due date of the
+most recent paid invoice.
+"""
+import time
+from datetime import date
+from typing import Optional
+
+import numpy as np
+from strands import tool
+
+from invoice_tools import list_all_invoices
+from ledger_snapshot import compute_version, ledger_cache
+
+FEATURES = [
+    "paid_rate",
+    "recent_paid_rate_delta",
+    "avg_days_late",
+    "months_since_last_payment",
+    "amount_concentration",
+    "amount_share",
+    "log_amount",
+]
+
+# Weight of an invoice in the recent paid rate halves every this many days
+RECENCY_HALF_LIFE_DAYS = 60.0
+# Used for customers who have never paid an invoice
+NO_PAYMENT_DAYS = 365.0
+# Extra days of expected delay for a zero-propensity invoice, on top of how late it already is
+MAX_EXTRA_DELAY_DAYS = 30.0
+
+
+def _dates(values) -> np.ndarray:
+    return np.array([v[:10] if v else "NaT" for v in values], dtype="datetime64[D]")
+
+
+def _decode_dates(codes: np.ndarray, dictionary: list) -> np.ndarray:
+    # Parse each distinct string once; code -1 (null) indexes the trailing NaT
+    lookup = np.append(_dates(dictionary), np.datetime64("NaT", "D"))
+    return lookup[codes]
+
+
+def ledger_from_snapshot(snapshot) -> dict:
+    customer_codes, customer_ids = snapshot.encoded("customer_id")
+    invoice_codes, invoice_ids = snapshot.encoded("invoice_id")
+    status_codes, statuses = snapshot.encoded("status")
+    due_codes, due_dict = snapshot.encoded("due_date")
+    created_codes, created_dict = snapshot.encoded("created_at")
+
+    status = np.frombuffer(status_codes, dtype=np.int32)
+    code_of = {value: code for code, value in enumerate(statuses)}
+    return {
+        "customer": np.frombuffer(customer_codes, dtype=np.int32),
+        "customer_ids": customer_ids,
+        "invoice": np.frombuffer(invoice_codes, dtype=np.int32),
+        "invoice_ids": invoice_ids,
+        "paid": status == code_of.get("paid", -2),
+        "open": status == code_of.get("sent", -2),
+        "amount": np.frombuffer(snapshot.encoded("amount"), dtype=np.float64),
+        "days_overdue": np.frombuffer(snapshot.encoded("days_overdue"), dtype=np.int32),
+        "due": _decode_dates(np.frombuffer(due_codes, dtype=np.int32), due_dict),
+        "created": _decode_dates(np.frombuffer(created_codes, dtype=np.int32), created_dict),
+    }
+
+
+def ledger_from_rows(rows: list) -> dict:
+    customer_ids, customer = np.unique(
+        np.array([r["customer_id"] for r in rows], dtype=object).astype(str), return_inverse=True
+    )
+    status = np.array([r["status"] for r in rows], dtype=object)
+    return {
+        "customer": customer.astype(np.int32),
+        "customer_ids": customer_ids.tolist(),
+        "invoice": np.arange(len(rows), dtype=np.int32),
+        "invoice_ids": [r["invoice_id"] for r in rows],
+        "paid": status == "paid",
+        "open": status == "sent",
+        "amount": np.array([float(r["amount"] or 0) for r in rows], dtype=np.float64),
+        "days_overdue": np.array([int(r["days_overdue"] or 0) for r in rows], dtype=np.int32),
+        "due": _dates([r["due_date"] for r in rows]),
+        "created": _dates([r["created_at"] for r in rows]),
+    }
+
+
+def _days(dates: np.ndarray, today: np.datetime64) -> np.ndarray:
+    """Days from dates to today as float, NaN where the date is missing"""
+    days = (today - dates).astype("timedelta64[D]")
+    return np.where(np.isnat(days), np.nan, days.astype(np.int64).astype(np.float64))
+
+
+def build_features(ledger: dict, today: np.datetime64):
+    """Per-invoice feature matrix plus per-customer aggregates.
+
+    Customer aggregates attached to an invoice leave that invoice out, so its
+    own outcome never leaks into its features during training.
+    """
+    c = ledger["customer"]
+    k = len(ledger["customer_ids"])
+    paid = ledger["paid"].astype(np.float64)
+    amount = ledger["amount"]
+    late = np.where(ledger["open"], ledger["days_overdue"], 0).astype(np.float64)
+    age = np.nan_to_num(_days(ledger["created"], today), nan=0.0).clip(min=0)
+
+    def total(values):
+        return np.bincount(c, weights=values, minlength=k)
+
+    def leave_one_out(values):
+        return total(values)[c] - values
+
+    n = np.bincount(c, minlength=k).astype(np.float64)
+    others = n[c] - 1
+
+    # Laplace-smoothed so single-invoice customers sit at 0.5 rather than 0 or 1
+    paid_rate = (leave_one_out(paid) + 1) / (others + 2)
+    weight = 0.5 ** (age / RECENCY_HALF_LIFE_DAYS)
+    recent_rate = (leave_one_out(weight * paid) + 1) / (leave_one_out(weight) + 2)
+    avg_late = leave_one_out(late) / np.maximum(others, 1)
+
+    amount_total = total(amount)
+    concentration = total(amount ** 2)[c] / np.maximum(amount_total[c] ** 2, 1e-9)
+    share = amount / np.maximum(amount_total[c], 1e-9)
+
+    # Latest and second-latest paid due date per customer, so an invoice can exclude itself
+    paid_days_ago = np.where(ledger["paid"], _days(ledger["due"], today), np.nan)
+    paid_days_ago = np.nan_to_num(paid_days_ago, nan=np.inf)
+    order = np.lexsort((-paid_days_ago, c))
+    sorted_c, sorted_t = c[order], paid_days_ago[order]
+    group_end = np.ones(len(c), dtype=bool)
+    group_end[:-1] = sorted_c[1:] != sorted_c[:-1]
+    latest = np.full(k, np.inf)
+    latest[sorted_c[group_end]] = sorted_t[group_end]
+    second = np.full(k, np.inf)
+    has_prev = np.zeros(len(c), dtype=bool)
+    has_prev[1:] = sorted_c[1:] == sorted_c[:-1]
+    ends_with_prev = group_end & has_prev
+    second[sorted_c[ends_with_prev]] = sorted_t[np.flatnonzero(ends_with_prev) - 1]
+    is_latest = np.zeros(len(c), dtype=bool)
+    is_latest[order[group_end]] = True
+    since_payment = np.where(is_latest, second[c], latest[c]).clip(0, NO_PAYMENT_DAYS)
+
+    X = np.column_stack([
+        paid_rate,
+        recent_rate - paid_rate,
+        avg_late,
+        since_payment / 30.0,
+        concentration,
+        share,
+        np.log1p(np.maximum(amount, 0)),
+    ])
+
+    customers = {
+        "invoices": n,
+        "paid_rate": total(paid) / np.maximum(n, 1),
+        "avg_days_late": total(late) / np.maximum(total(ledger["open"].astype(np.float64)), 1),
+        "days_since_last_payment": latest.clip(0, NO_PAYMENT_DAYS),
+    }
+    return X, customers, avg_late
+
+
+class LogisticModel:
+    """Batch gradient-descent logistic regression on standardized features"""
+
+    def __init__(self, l2: float = 1e-2, iterations: int = 300, learning_rate: float = 0.5):
+        self.l2 = l2
+        self.iterations = iterations
+        self.learning_rate = learning_rate
+        self.weights = None
+        self.bias = 0.0
+        self.mean = None
+        self.std = None
+
+    def fit(self, X: np.ndarray, y: np.ndarray) -> "LogisticModel":
+        self.mean = X.mean(axis=0)
+        self.std = X.std(axis=0)
+        self.std[self.std == 0] = 1.0
+        Z = (X - self.mean) / self.std
+
+        prior = np.clip(y.mean(), 1e-6, 1 - 1e-6)
+        self.weights = np.zeros(X.shape[1])
+        self.bias = float(np.log(prior / (1 - prior)))
+        for _ in range(self.iterations):
+            error = self._sigmoid(Z @ self.weights + self.bias) - y
+            self.weights -= self.learning_rate * (Z.T @ error / len(y) + self.l2 * self.weights)
+            self.bias -= self.learning_rate * float(error.mean())
+        return self
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        return self._sigmoid(((X - self.mean) / self.std) @ self.weights + self.bias)
+
+    @staticmethod
+    def _sigmoid(z: np.ndarray) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def risk_levels(probability: np.ndarray) -> np.ndarray:
+    """Same cutoffs the agents already use for payment rate"""
+    return np.where(probability >= 0.9, "LOW", np.where(probability >= 0.7, "MEDIUM", "HIGH"))
+
+
+def score_ledger(ledger: dict, today: Optional[np.datetime64] = None) -> dict:
+    """Fit on settled outcomes and score every open invoice"""
+    today = today if today is not None else np.datetime64(date.today(), "D")
+    X, customers, avg_late = build_features(ledger, today)
+
+    # Paid is a positive outcome, overdue and unpaid a negative one; not-yet-due is unknown
+    labelled = ledger["paid"] | (ledger["open"] & (ledger["days_overdue"] > 0))
+    y = ledger["paid"][labelled].astype(np.float64)
+    model = None
+    if len(y) >= 10 and 0 < y.sum() < len(y):
+        model = LogisticModel().fit(X[labelled], y)
+
+    open_idx = np.flatnonzero(ledger["open"])
+    X_open = X[open_idx]
+    # Without both outcomes to learn from, fall back to the smoothed paid rate
+    probability = model.predict_proba(X_open) if model is not None else X_open[:, 0]
+
+    # Days from today: until the due date, then whatever is left of the customer's usual
+    # lateness, then a propensity-scaled wait that grows with how late the invoice already is
+    overdue = ledger["days_overdue"][open_idx].astype(np.float64)
+    until_due = np.nan_to_num(-_days(ledger["due"][open_idx], today), nan=0.0).clip(min=0)
+    expected_delay = (
+        until_due
+        + np.maximum(avg_late[open_idx] - overdue, 0)
+        + (1 - probability) * (MAX_EXTRA_DELAY_DAYS + overdue)
+    )
+    pay_date = today + np.round(expected_delay).astype(np.int64).astype("timedelta64[D]")
+
+    # Customer propensity: mean over open invoices, else the smoothed paid rate
+    c_open = ledger["customer"][open_idx]
+    k = len(ledger["customer_ids"])
+    open_count = np.bincount(c_open, minlength=k)
+    customer_probability = np.where(
+        open_count > 0,
+        np.bincount(c_open, weights=probability, minlength=k) / np.maximum(open_count, 1),
+        (customers["paid_rate"] * customers["invoices"] + 1) / (customers["invoices"] + 2),
+    )
+    customers["probability"] = customer_probability
+    customers["risk_level"] = risk_levels(customer_probability)
+
+    return {
+        "open_idx": open_idx,
+        "probability": probability,
+        "pay_date": pay_date,
+        "customers": customers,
+        "model": model,
+        "trained_on": int(labelled.sum()),
+    }
+
+
+# (version, day) -> ledger and scores, recomputed when the ledger version or day changes
+_scores_cache = {}
+
+
+def _current_scores():
+    snapshot = ledger_cache.get()
+    if snapshot is not None:
+        version = snapshot.version
+        load = lambda: ledger_from_snapshot(snapshot)
+    else:
+        all_invoices = list_all_invoices()
+        if not all_invoices["success"]:
+            raise RuntimeError(all_invoices["error"])
+        rows = all_invoices["all_invoices"]
+        # Same stamp the snapshot uses, so both paths share cached scores
+        version = compute_version(rows)
+        load = lambda: ledger_from_rows(rows)
+
+    key = (version, date.today())
+    cached = _scores_cache.get("entry")
+    if cached is None or cached[0] != key:
+        ledger = load()
+        cached = _scores_cache["entry"] = (key, ledger, score_ledger(ledger))
+    return cached[1], cached[2]
+
+
+def _invoice_prediction(ledger: dict, scores: dict, i: int) -> dict:
+    row = scores["open_idx"][i]
+    return {
+        "invoice_id": ledger["invoice_ids"][ledger["invoice"][row]],
+        "customer_id": ledger["customer_ids"][ledger["customer"][row]],
+        "amount": float(ledger["amount"][row]),
+        "days_overdue": int(ledger["days_overdue"][row]),
+        "payment_probability": round(float(scores["probability"][i]), 3),
+        "predicted_pay_date": str(scores["pay_date"][i])
+    }
+
+
+@tool
+def score_payment_propensity(customer_id: Optional[str] = None, limit: int = 20) -> dict:
+    """Score payment propensity for every open invoice in the ledger. Returns the given customer's open invoices with payment probability and predicted pay date, or the least likely to be paid across all customers"""
+
+    try:
+        start = time.perf_counter()
+        ledger, scores = _current_scores()
+        customers = scores["customers"]
+        probability = scores["probability"]
+
+        if customer_id is not None:
+            try:
+                c = ledger["customer_ids"].index(customer_id)
+            except ValueError:
+                return {
+                    "success": False,
+                    "error": f"No invoices found for customer {customer_id}"
+                }
+            mine = np.flatnonzero(ledger["customer"][scores["open_idx"]] == c)
+            return {
+                "success": True,
+                "customer_id": customer_id,
+                "payment_probability": round(float(customers["probability"][c]), 3),
+                "risk_level": str(customers["risk_level"][c]),
+                "paid_rate": round(float(customers["paid_rate"][c]), 3),
+                "avg_days_late": round(float(customers["avg_days_late"][c]), 1),
+                "days_since_last_payment": int(customers["days_since_last_payment"][c]),
+                "open_invoices": [_invoice_prediction(ledger, scores, i) for i in mine]
+            }
+
+        riskiest = np.argsort(probability)[:limit]
+        levels, counts = np.unique(customers["risk_level"], return_counts=True)
+        model = scores["model"]
+        return {
+            "success": True,
+            "customers_scored": len(ledger["customer_ids"]),
+            "open_invoices_scored": len(probability),
+            "expected_collections": round(float(
+                (probability * ledger["amount"][scores["open_idx"]]).sum()
+            ), 2),
+            "risk_distribution": {str(level): int(count) for level, count in zip(levels, counts)},
+            "least_likely_to_pay": [_invoice_prediction(ledger, scores, i) for i in riskiest],
+            "model": "logistic_regression" if model is not None else "smoothed_paid_rate",
+            "feature_weights": (
+                dict(zip(FEATURES, np.round(model.weights, 3).tolist())) if model is not None else {}
+            ),
+            "trained_on_invoices": scores["trained_on"],
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+        }
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Error scoring payment propensity: {str(e)}"
+        }
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    from invoice_tools import _process_invoices
+    from ledger_snapshot import LedgerSnapshot, write_snapshot
+    from local_api import generate_invoices
+
+    print("Generating 100k customers x 5 invoices...")
+    rows = _process_invoices(generate_invoices(num_customers=100_000).values())
+    path = os.path.join(tempfile.mkdtemp(prefix="abi-scoring-"), "ledger.snap")
+    write_snapshot(path, rows, {}, compute_version(rows))
+
+    start = time.perf_counter()
+    ledger = ledger_from_snapshot(LedgerSnapshot(path))
+    loaded = time.perf_counter()
+    scores = score_ledger(ledger)
+    done = time.perf_counter()
+    print(f"load from snapshot: {loaded - start:.2f}s, score: {done - loaded:.2f}s, "
+          f"open invoices scored: {len(scores['probability'])}")
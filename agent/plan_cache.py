@@ -0,0 +1,549 @@
+# tools/plan_cache.py
+"""Record the read-only tool calls of a successful agent run and prefetch them next time.
+
+Recurring tasks ("process all sent invoices", "handle overdue accounts") make
+the model re-plan the same lookups on every run, one Bedrock round trip per
+step. After a successful run the calls to read-only tools in the agent's
+conversation are turned into a small DAG:
+
+- arguments that match a value in an earlier tool result become references
+  to that result; arguments matching an ID, date or number in the task text
+  become task parameters; other numbers and strings the task itself spells
+  out stay literals, and any other argument means the run is not cached
+- repeated calls of one tool over elements of the same list become a single
+  "map" step, with the subset the model picked captured as a predicate over
+  the elements' fields (e.g. email_sent == False or is_overdue == True)
+
+The plan is keyed by a normalized task signature. On the next run, steps whose
+dependencies are done run in parallel and the model gets their results with
+the task, so it only makes the calls that change something (emails, status
+updates) and writes the reply itself. Side-effecting calls are never replayed:
+which invoices to act on and what to send is decided by the model every run.
+If a result no longer matches the recorded schema, the plan is dropped and
+the model runs the task from scratch.
+"""
+import ast
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Plans decide which tool calls run, so they live in a directory only this user can write
+PLAN_CACHE_PATH = os.environ.get("PLAN_CACHE_PATH") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "abi-agent", "plans.json"
+)
+REPLAY_WORKERS = int(os.environ.get("PLAN_REPLAY_WORKERS", "8"))
+
+# Tools without side effects; only calls to these are recorded and replayed
+READ_ONLY_TOOLS = frozenset({
+    "get_invoice_details",
+    "list_all_invoices",
+    "get_overdue_invoices",
+    "get_customer_invoice_history",
+    "get_customer_id_from_invoice",
+    "score_payment_propensity",
+})
+
+# IDs, dates and numbers in the task text; these become plan parameters
+TASK_PARAMETER = re.compile(
+    r"\b[A-Za-z]+-[A-Za-z0-9-]*\d[A-Za-z0-9-]*\b"
+    r"|\b\d{4}-\d{2}-\d{2}\b"
+    r"|\b\d+(?:\.\d+)?\b"
+)
+
+
+class PlanDiverged(Exception):
+    """A replayed step returned something the recorded plan did not expect"""
+
+
+def task_signature(task: str, tool_names: List[str]) -> Tuple[str, List[str]]:
+    """Normalized task hash plus the parameter values that were abstracted out"""
+    params = TASK_PARAMETER.findall(task)
+    normalized = " ".join(TASK_PARAMETER.sub("<param>", task).lower().split())
+    key = normalized + "|" + ",".join(sorted(tool_names))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest(), params
+
+
+def tool_name(tool) -> str:
+    return getattr(tool, "tool_name", None) or tool.__name__
+
+
+def parse_tool_result(content: list) -> Any:
+    """A toolResult's content as the tool's return value where it parses, else the raw text"""
+    for block in content:
+        if "json" in block:
+            return block["json"]
+    text = "".join(block.get("text", "") for block in content)
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            return parse(text)
+        except (ValueError, SyntaxError):
+            continue
+    return text
+
+
+def extract_tool_calls(messages: list) -> Optional[List[dict]]:
+    """Ordered tool calls with their results, or None if any call errored or reported failure"""
+    calls = {}
+    order = []
+    for message in messages:
+        for block in message.get("content", []):
+            if "toolUse" in block:
+                use = block["toolUse"]
+                calls[use["toolUseId"]] = {"tool": use["name"], "input": use.get("input") or {}}
+                order.append(use["toolUseId"])
+            elif "toolResult" in block:
+                result = block["toolResult"]
+                if result.get("status") == "error":
+                    return None
+                parsed = parse_tool_result(result.get("content", []))
+                # The tools report failures in their result rather than raising
+                if isinstance(parsed, dict) and parsed.get("success") is False:
+                    return None
+                if result["toolUseId"] in calls:
+                    calls[result["toolUseId"]]["result"] = parsed
+    if any("result" not in calls[use_id] for use_id in order):
+        return None
+    return [calls[use_id] for use_id in order]
+
+
+def result_schema(value: Any) -> Any:
+    """Type skeleton of a tool result: dict keys, first list element, scalar type names"""
+    if isinstance(value, dict):
+        return {k: result_schema(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [result_schema(value[0])] if value else []
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if value is None:
+        return "null"
+    return type(value).__name__
+
+
+def schema_matches(expected: Any, actual: Any) -> bool:
+    """Every recorded key and type is still there; extra keys, empty lists and nulls are fine"""
+    if expected == "null" or actual == "null":
+        return True
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(
+            k in actual and schema_matches(v, actual[k]) for k, v in expected.items()
+        )
+    if isinstance(expected, list):
+        if not isinstance(actual, list):
+            return False
+        return not expected or not actual or schema_matches(expected[0], actual[0])
+    return expected == actual
+
+
+def _leaves(value: Any, path: tuple = ()):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _leaves(v, path + (k,))
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            yield from _leaves(v, path + (i,))
+    elif isinstance(value, str) and value or isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield path, value
+
+
+def _get_path(value: Any, path) -> Any:
+    for key in path:
+        value = value[key]
+    return value
+
+
+def _split_list_path(path: tuple):
+    """(prefix up to the last list index, index, remainder) or None for index-free paths"""
+    for pos in range(len(path) - 1, -1, -1):
+        if isinstance(path[pos], int):
+            return path[:pos], path[pos], path[pos + 1:]
+    return None
+
+
+def _learn_predicate(elements: List[dict], selected: set) -> Optional[list]:
+    """Smallest OR/AND of at most two field == value tests that picks exactly the selected elements"""
+    if len(selected) == len(elements):
+        return []
+    # Flags and low-cardinality categories only; an OR of two IDs would just memorize the run
+    values_of: Dict[str, set] = {}
+    for element in elements:
+        if isinstance(element, dict):
+            for field, value in element.items():
+                if isinstance(value, (bool, str)) or value is None:
+                    values_of.setdefault(field, set()).add(value)
+    literals = set()
+    for field, values in values_of.items():
+        if all(isinstance(v, bool) or v is None for v in values) or len(values) <= min(5, len(elements) // 2):
+            literals.update((field, value) for value in values)
+
+    def picks(test):
+        return {i for i, e in enumerate(elements) if isinstance(e, dict) and test(e)}
+
+    def holds(e, literal):
+        return e.get(literal[0]) == literal[1]
+
+    literals = sorted(literals, key=repr)
+    for literal in literals:
+        if picks(lambda e: holds(e, literal)) == selected:
+            return [["any", [list(literal)]]]
+    for a, b in combinations(literals, 2):
+        if picks(lambda e: holds(e, a) or holds(e, b)) == selected:
+            return [["any", [list(a), list(b)]]]
+        if picks(lambda e: holds(e, a) and holds(e, b)) == selected:
+            return [["all", [list(a), list(b)]]]
+    return None
+
+
+def _predicate_holds(predicate: list, element: Any) -> bool:
+    for mode, literals in predicate:
+        tests = [isinstance(element, dict) and element.get(f) == v for f, v in literals]
+        if not (any(tests) if mode == "any" else all(tests)):
+            return False
+    return True
+
+
+def _in_task(value: str, task: str) -> bool:
+    return re.search(r"(?<!\w)" + re.escape(value) + r"(?!\w)", task, re.IGNORECASE) is not None
+
+
+def build_plan(calls: List[dict], params: List[str], tools: Dict[str, Any], task: str) -> Optional[dict]:
+    """Generalize the read-only calls of a recorded run into a replayable plan, or None if it can't be done safely"""
+    calls = [call for call in calls if call["tool"] in READ_ONLY_TOOLS and call["tool"] in tools]
+    if not calls:
+        return None
+
+    # Where every argument value shows up in earlier results
+    seen: Dict[Any, List[tuple]] = {}
+    candidates = []
+    for i, call in enumerate(calls):
+        arg_candidates = {}
+        for arg, value in call["input"].items():
+            scalar = isinstance(value, (str, int, float)) and not isinstance(value, bool)
+            arg_candidates[arg] = list(seen.get(value, [])) if scalar else []
+        candidates.append(arg_candidates)
+        for path, leaf in _leaves(call["result"]):
+            seen.setdefault(leaf, []).append((i, path))
+
+    # Lists that each call's arguments point into, with the element indices they agree on
+    def lists_of(i):
+        covered: Dict[tuple, set] = {}
+        for found in candidates[i].values():
+            per_arg: Dict[tuple, set] = {}
+            for j, path in found:
+                split = _split_list_path(path)
+                if split:
+                    per_arg.setdefault((j, split[0]), set()).add(split[1])
+            for source, idx in per_arg.items():
+                covered[source] = covered[source] & idx if source in covered else idx
+        return {source: idx for source, idx in covered.items() if idx}
+
+    # Group same-tool calls by the list that covers the most of them
+    by_tool: Dict[str, List[int]] = {}
+    for i, call in enumerate(calls):
+        by_tool.setdefault(call["tool"], []).append(i)
+    coverage_of = {}
+    for name, indices in by_tool.items():
+        coverage: Dict[tuple, Dict[int, set]] = {}
+        for i in indices:
+            for source, idx in lists_of(i).items():
+                coverage.setdefault(source, {})[i] = idx
+        if len(indices) >= 2 and coverage:
+            coverage_of[name] = coverage
+
+    def ambiguity(name):
+        best = max(len(members) for members in coverage_of[name].values())
+        return sum(
+            len(idx) for members in coverage_of[name].values()
+            if len(members) == best for idx in members.values()
+        )
+
+    # Tools keyed by a unique field (invoice_id) go first; tools keyed by a shared field
+    # (customer_id) then follow the list and index of the call next to them
+    map_of = {}
+    for name in sorted(coverage_of, key=ambiguity):
+        decided = {source for source, _ in map_of.values()}
+        source, members = max(
+            coverage_of[name].items(),
+            key=lambda item: (len(item[1]), item[0] in decided,
+                              -len(_get_path(calls[item[0][0]]["result"], item[0][1])))
+        )
+        if len(members) < 2:
+            continue
+        used = set()
+        for i in sorted(members):
+            neighbours = [map_of[k][1] for k in (i + 1, i - 1) if k in map_of and map_of[k][0] == source]
+            picks = [idx for idx in neighbours if idx in members[i]]
+            picks = picks or sorted(members[i] - used) or sorted(members[i])
+            map_of[i] = (source, picks[0])
+            used.add(picks[0])
+
+    def bind_scalar(i, arg, value):
+        mapped = map_of.get(i)
+        for j, path in candidates[i][arg]:
+            split = _split_list_path(path)
+            if mapped and split and (j, split[0]) == mapped[0] and split[1] == mapped[1]:
+                return {"$item": list(split[2])}
+        # Prefer fixed positions in earlier results over list elements picked by index
+        for j, path in reversed(candidates[i][arg]):
+            if j not in map_of and _split_list_path(path) is None:
+                return {"$ref": [j, list(path)]}
+        text = str(value) if not isinstance(value, bool) else None
+        if text in params:
+            return {"$param": params.index(text)}
+        # A string the task doesn't spell out was chosen for this run only (an ID, free text)
+        if value is None or isinstance(value, (bool, int, float)) or \
+                isinstance(value, str) and _in_task(value, task):
+            return {"$literal": value}
+        return None
+
+    steps = []
+    step_of_call = {}
+    groups: Dict[tuple, dict] = {}
+    for i, call in enumerate(calls):
+        args = {arg: bind_scalar(i, arg, value) for arg, value in call["input"].items()}
+        if any(binding is None for binding in args.values()):
+            return None
+        if i in map_of:
+            key = (call["tool"], map_of[i][0])
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    "tool": call["tool"],
+                    "map": {"$ref": [map_of[i][0][0], list(map_of[i][0][1])]},
+                    "calls": [],
+                    "schema": result_schema(call["result"]),
+                }
+                steps.append(group)
+            group["calls"].append((i, map_of[i][1], args))
+            step_of_call[i] = group
+        else:
+            step = {"tool": call["tool"], "args": args, "schema": result_schema(call["result"])}
+            steps.append(step)
+            step_of_call[i] = step
+
+    for step in steps:
+        if "map" not in step:
+            continue
+        # Arguments must be the same for every element or come from the element
+        merged = {}
+        for arg in {a for _, _, args in step["calls"] for a in args}:
+            bindings = [args.get(arg) for _, _, args in step["calls"]]
+            if bindings[0] is None or any(b != bindings[0] for b in bindings):
+                return None
+            merged[arg] = bindings[0]
+
+        (j, list_path) = step["map"]["$ref"]
+        elements = _get_path(calls[j]["result"], list_path)
+        predicate = _learn_predicate(elements, {idx for _, idx, _ in step["calls"]})
+        if predicate is None:
+            return None
+        step["args"] = merged
+        step["where"] = predicate
+        del step["calls"]
+
+    # Renumber references from call index to step index
+    index_of = {id(step): n for n, step in enumerate(steps)}
+    for step in steps:
+        deps = set()
+        refs = list(step["args"].values()) + ([step["map"]] if "map" in step else [])
+        for ref in refs:
+            if "$ref" in ref:
+                source = step_of_call[ref["$ref"][0]]
+                if "map" in source:
+                    return None
+                ref["$ref"][0] = index_of[id(source)]
+                deps.add(ref["$ref"][0])
+        step["deps"] = sorted(deps)
+    return {"steps": steps, "created_at": time.time()}
+
+
+class PlanCache:
+    """Plans keyed by task signature, persisted as one JSON file.
+
+    The file is only read from and written to a directory owned by the current
+    user and closed to everyone else; otherwise plans are kept in memory only.
+    """
+
+    def __init__(self, path: str = PLAN_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._plans: Optional[dict] = None
+
+    def _private_directory(self) -> Optional[str]:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            st = os.stat(directory)
+        except OSError:
+            return None
+        if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+            return None
+        return directory
+
+    def _load(self) -> dict:
+        if self._plans is None:
+            self._plans = {}
+            if self._private_directory() is not None:
+                try:
+                    with open(self.path) as f:
+                        self._plans = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        return self._plans
+
+    def _save(self) -> None:
+        directory = self._private_directory()
+        if directory is None:
+            return
+        tmp_path = None
+        try:
+            # mkstemp creates the file readable and writable by its owner only
+            fd, tmp_path = tempfile.mkstemp(prefix=".plans-", dir=directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._plans, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # Plans stay usable in memory for this process
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def get(self, signature: str) -> Optional[dict]:
+        with self._lock:
+            return self._load().get(signature)
+
+    def put(self, signature: str, plan: dict) -> None:
+        with self._lock:
+            self._load()[signature] = plan
+            self._save()
+
+    def invalidate(self, signature: str) -> None:
+        with self._lock:
+            if self._load().pop(signature, None) is not None:
+                self._save()
+
+
+def _resolve(binding: dict, params: List[str], results: Dict[int, Any], element: Any = None) -> Any:
+    if "$literal" in binding:
+        return binding["$literal"]
+    if "$param" in binding:
+        return params[binding["$param"]]
+    if "$item" in binding:
+        return _get_path(element, binding["$item"])
+    step, path = binding["$ref"]
+    return _get_path(results[step], path)
+
+
+def _run_wave(steps: list, ready: List[int], params: List[str], results: Dict[int, Any],
+              pool: ThreadPoolExecutor, run) -> list:
+    """Submit every call of the ready steps; map steps fan out over their chosen elements"""
+    futures = []
+    try:
+        for n in ready:
+            step = steps[n]
+            if "map" in step:
+                elements = _resolve(step["map"], params, results)
+                if not isinstance(elements, list):
+                    raise PlanDiverged(f"step {n} ({step['tool']}) expected a list to map over")
+                chosen = [e for e in elements if _predicate_holds(step["where"], e)]
+                for element in chosen:
+                    args = {a: _resolve(b, params, results, element) for a, b in step["args"].items()}
+                    futures.append((n, True, pool.submit(run, step["tool"], args)))
+            else:
+                args = {a: _resolve(b, params, results) for a, b in step["args"].items()}
+                futures.append((n, False, pool.submit(run, step["tool"], args)))
+    except (KeyError, IndexError, TypeError) as e:
+        raise PlanDiverged(f"could not bind arguments: {str(e)}")
+    return futures
+
+
+def replay_plan(plan: dict, params: List[str], tools: Dict[str, Any]) -> List[dict]:
+    """Run the plan's read-only calls, independent steps in parallel.
+
+    Returns every call made with its result. Raises PlanDiverged when a result
+    stops matching the recorded schema.
+    """
+    steps = plan["steps"]
+    results: Dict[int, Any] = {}
+    completed: List[dict] = []
+    lock = threading.Lock()
+
+    def run(name, args):
+        result = tools[name](**args)
+        with lock:
+            completed.append({"tool": name, "input": args, "result": result})
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=REPLAY_WORKERS) as pool:
+            remaining = set(range(len(steps)))
+            while remaining:
+                ready = [n for n in sorted(remaining) if all(d in results for d in steps[n]["deps"])]
+                if not ready:
+                    raise PlanDiverged("plan has a dependency cycle")
+
+                for n, element_call, future in _run_wave(steps, ready, params, results, pool, run):
+                    result = future.result()
+                    if schema_matches(steps[n]["schema"], result_schema(result)):
+                        if not element_call:
+                            results[n] = result
+                    elif not (element_call and isinstance(result, dict) and result.get("success") is False):
+                        # A failed element is passed on to the model like any other result
+                        raise PlanDiverged(f"step {n} ({steps[n]['tool']}) returned an unexpected result")
+                for n in ready:
+                    results.setdefault(n, None)
+                    remaining.discard(n)
+    except PlanDiverged:
+        raise
+    except Exception as e:
+        raise PlanDiverged(f"replay failed: {str(e)}")
+    return completed
+
+
+# Shared by every agent in the process
+plan_cache = PlanCache()
+
+
+def run_with_plan_cache(agent, task: str, tools: list):
+    """Prefetch the cached read-only calls for this task if there is a plan, then run the agent.
+
+    Without a plan the agent runs the task as is and its read-only calls are
+    recorded, if every call in the run succeeded.
+    """
+    registry = {tool_name(t): t for t in tools}
+    signature, params = task_signature(task, list(registry))
+
+    plan = plan_cache.get(signature)
+    if plan is not None:
+        try:
+            prefetched = replay_plan(plan, params, registry)
+        except PlanDiverged:
+            # Re-plan from scratch and record the new run instead
+            plan_cache.invalidate(signature)
+            plan = None
+        else:
+            task = (
+                f"{task}\n\nNOTE: these read-only tool calls for this task were already made, "
+                f"use their results instead of repeating them. Call tools yourself for anything "
+                f"else you need, including every email or status update:\n"
+                + "\n".join(json.dumps(call, default=str) for call in prefetched)
+            )
+
+    start = len(agent.messages)
+    response = agent(task)
+    if plan is None:
+        calls = extract_tool_calls(agent.messages[start:])
+        if calls:
+            new_plan = build_plan(calls, params, registry, task)
+            if new_plan is not None:
+                plan_cache.put(signature, new_plan)
+    return response
@@ -0,0 +1,273 @@
+# tools/resilience.py
+import asyncio
+import threading
+import time
+from typing import Callable, Optional
+
+from botocore.exceptions import ClientError, ConnectionError as EndpointError, HTTPClientError
+from strands.models import BedrockModel
+from strands.types.exceptions import ModelThrottledException
+
+
+class BackendUnavailable(Exception):
+    """Raised when a backend call is rejected before it is sent"""
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter: grow the limit by one per window of successes, halve it on overload.
+
+    The limit is cut at most once per congestion window: an overloaded
+    response only counts if its request started after the previous cut, so a
+    burst of rejections from one window halves the limit once, not once each.
+    Pass a multiprocessing context to keep the state in shared memory, so
+    several worker processes adapt one limit together.
+    """
+
+    # Slots of the state array
+    _LIMIT, _IN_FLIGHT, _STARTED, _CUT_AT = range(4)
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 backoff_ratio: float = 0.5, acquire_timeout: float = 30.0, context=None):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.acquire_timeout = acquire_timeout
+        state = [float(initial_limit), 0.0, 0.0, 0.0]
+        if context is None:
+            self._cond = threading.Condition()
+            self._state = state
+        else:
+            self._cond = context.Condition()
+            self._state = context.Array("d", state, lock=False)
+
+    @property
+    def limit(self) -> float:
+        return self._state[self._LIMIT]
+
+    @property
+    def in_flight(self) -> int:
+        return int(self._state[self._IN_FLIGHT])
+
+    def shared(self, context) -> "AdaptiveLimiter":
+        """A copy of this limiter whose state lives in memory shared across processes"""
+        return AdaptiveLimiter(self.limit, self.min_limit, self.max_limit,
+                               self.backoff_ratio, self.acquire_timeout, context=context)
+
+    def acquire(self) -> int:
+        """Wait for a slot; returns the request's start sequence number for release()"""
+        deadline = time.monotonic() + self.acquire_timeout
+        state = self._state
+        with self._cond:
+            while state[self._IN_FLIGHT] >= int(state[self._LIMIT]):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BackendUnavailable(
+                        f"no capacity after {self.acquire_timeout}s (limit {int(state[self._LIMIT])})"
+                    )
+                self._cond.wait(remaining)
+            state[self._IN_FLIGHT] += 1
+            state[self._STARTED] += 1
+            return int(state[self._STARTED])
+
+    def release(self, started: int, overloaded: bool) -> None:
+        state = self._state
+        with self._cond:
+            state[self._IN_FLIGHT] -= 1
+            if overloaded:
+                if started > state[self._CUT_AT]:
+                    # Multiplicative decrease, once for everything already in flight
+                    state[self._LIMIT] = max(self.min_limit, state[self._LIMIT] * self.backoff_ratio)
+                    state[self._CUT_AT] = state[self._STARTED]
+            elif state[self._LIMIT] < self.max_limit:
+                # Additive increase: +1 after roughly `limit` successful calls
+                state[self._LIMIT] = min(self.max_limit, state[self._LIMIT] + 1.0 / state[self._LIMIT])
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """Open after consecutive failures, then let a single probe through once the cooldown has passed.
+
+    before_call() hands out a (generation, is_probe) token. Every state change
+    starts a new generation, and results from an earlier generation are
+    ignored, so only the probe itself can close or reopen the breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._generation = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        self._generation += 1
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+        elif state == self.CLOSED:
+            self.failures = 0
+
+    def before_call(self) -> tuple:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return self._generation, False
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    raise BackendUnavailable("circuit open")
+                self._transition(self.HALF_OPEN)
+            if self._probe_in_flight:
+                raise BackendUnavailable("circuit half-open, probe in flight")
+            self._probe_in_flight = True
+            return self._generation, True
+
+    def cancel(self, token: tuple) -> None:
+        generation, is_probe = token
+        with self._lock:
+            if is_probe and generation == self._generation:
+                self._probe_in_flight = False
+
+    def record(self, token: tuple, success: bool) -> None:
+        generation, is_probe = token
+        with self._lock:
+            if generation != self._generation:
+                # Started before the last state change; its outcome is stale
+                return
+            if is_probe:
+                self._probe_in_flight = False
+                self._transition(self.CLOSED if success else self.OPEN)
+                return
+            if success:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self._transition(self.OPEN)
+
+
+class Backend:
+    """A remote dependency guarded by its own limiter and circuit breaker"""
+
+    def __init__(self, name: str, limiter: Optional[AdaptiveLimiter] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+
+    def begin(self) -> tuple:
+        """Admit one call; pass the returned token to finish() once it completes"""
+        try:
+            probe = self.breaker.before_call()
+        except BackendUnavailable as e:
+            raise BackendUnavailable(f"{self.name}: {e}") from None
+
+        try:
+            started = self.limiter.acquire()
+        except BackendUnavailable as e:
+            # Never reached the backend, so release the probe without judging health
+            self.breaker.cancel(probe)
+            raise BackendUnavailable(f"{self.name}: {e}") from None
+        return probe, started
+
+    def finish(self, token: tuple, overloaded: bool) -> None:
+        probe, started = token
+        self.limiter.release(started, overloaded)
+        self.breaker.record(probe, not overloaded)
+
+    def call(self, fn: Callable, is_overloaded: Optional[Callable] = None):
+        """Run fn() under the limiter and breaker.
+
+        Exceptions and results for which is_overloaded(result) is true count as
+        failures; anything else (including 4xx responses) counts as healthy.
+        """
+        token = self.begin()
+        overloaded = True
+        try:
+            result = fn()
+            overloaded = bool(is_overloaded and is_overloaded(result))
+            return result
+        finally:
+            self.finish(token, overloaded)
+
+    def status(self) -> dict:
+        return {
+            "backend": self.name,
+            "circuit_state": self.breaker.state,
+            "concurrency_limit": int(self.limiter.limit),
+            "in_flight": self.limiter.in_flight
+        }
+
+
+def is_overloaded_response(response) -> bool:
+    """Throttling and server errors mean back off; 4xx client errors do not"""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+# Bedrock error codes that are the service's problem rather than the request's
+OVERLOADED_ERROR_CODES = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+}
+
+
+def is_overloaded_error(error: Exception) -> bool:
+    """Same rule for model errors: throttling, 5xx and dropped connections back off;
+    client errors (validation, context window overflow) do not"""
+    if isinstance(error, ModelThrottledException):
+        return True
+    if isinstance(error, (EndpointError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return code in OVERLOADED_ERROR_CODES or status >= 500
+    return False
+
+
+# One guard per backend, shared by every tool and agent in the process
+api_gateway = Backend("api-gateway")
+email_gateway = Backend("send-email", limiter=AdaptiveLimiter(initial_limit=2, max_limit=8))
+bedrock = Backend("bedrock", limiter=AdaptiveLimiter(initial_limit=2, max_limit=8, acquire_timeout=120.0),
+                  breaker=CircuitBreaker(failure_threshold=3, recovery_timeout=60.0))
+BACKENDS = (api_gateway, email_gateway, bedrock)
+
+
+def share_limiters(context) -> dict:
+    """Process-shared copies of every backend's limiter, to hand to worker processes"""
+    return {backend.name: backend.limiter.shared(context) for backend in BACKENDS}
+
+
+def install_limiters(limiters: dict) -> None:
+    """Swap in limiters from share_limiters(), in a worker process"""
+    for backend in BACKENDS:
+        if backend.name in limiters:
+            backend.limiter = limiters[backend.name]
+
+
+class GuardedBedrockModel(BedrockModel):
+    """BedrockModel whose every model request goes through the bedrock guard.
+
+    Guards each request rather than a whole agent run, so a multi-turn run
+    holds a slot only while the model is actually generating.
+    """
+
+    async def stream(self, *args, **kwargs):
+        token = await asyncio.to_thread(bedrock.begin)
+        overloaded = False
+        try:
+            async for event in super().stream(*args, **kwargs):
+                yield event
+        except Exception as e:
+            overloaded = is_overloaded_error(e)
+            raise
+        finally:
+            bedrock.finish(token, overloaded)
@@ -0,0 +1,328 @@
+# tools/sharded_sweep.py
+"""Run the "process all sent invoices" sweep across a pool of worker processes.
+
+The full ledger is partitioned by a stable hash of customer_id, so every invoice
+for a customer lands on the same shard and that shard computes payment history
+from its own rows, with no further ledger downloads. Each worker process builds
+its own agent and HTTP connection pool.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from invoice_tools import customer_history_from, list_all_invoices
+from plan_cache import parse_tool_result
+from resilience import install_limiters, share_limiters
+
+# Invoices handed to the agent per turn, to keep the context bounded
+AGENT_BATCH_SIZE = 20
+
+SHARD_AGENT_PROMPT = """
+You are an Intelligent Billing Automation Agent working on one shard of the nightly invoice sweep. Your ONLY responsibility is to send personalized emails for the invoices you are given.
+
+## AVAILABLE TOOL:
+
+**send_personalized_email(customer_name: str, invoice_number: str, amount: float, days_overdue: int, customer_history: str, ai_generated_content: dict)**
+- Action: Sends personalized email and updates emailSent attribute in database
+- Use when: Ready to send invoice or follow-up emails
+
+Every invoice you are given already carries the customer's payment history; there are no other tools.
+
+## EMAIL RULES:
+- If emailSent = false → Send initial email immediately
+- If emailSent = true AND overdue → Send follow-up email
+- If emailSent = true AND not overdue → Skip
+
+## EMAIL PERSONALIZATION:
+Always generate ai_generated_content with:
+- subject: Personalized subject line
+- body: Contextual message content
+- tone: "gentle", "firm", or "urgent" based on situation
+- personalization_notes: Reasoning for approach
+
+## EMAIL TONE GUIDELINES:
+- **Initial emails**: Professional, welcoming tone
+- **1-7 days overdue**: Gentle reminder, understanding approach
+- **8-21 days overdue**: Firm professional, direct but respectful
+- **22+ days overdue**: Urgent tone, immediate action required
+
+## CUSTOMER RISK ASSESSMENT:
+- **LOW risk (>90% payment rate)**: Gentle, relationship-focused approach
+- **MEDIUM risk (70-90% payment rate)**: Professional, direct communication
+- **HIGH risk (<70% payment rate)**: Firm, consequence-focused messaging
+
+## OPERATIONAL CONSTRAINTS:
+- Never update invoice status
+- If an email fails, skip that invoice and continue with the others
+"""
+
+SHARD_TASK_PROMPT = """
+Process ONLY the invoices listed below (all have status "sent") and send emails based on the rules.
+Use each invoice's "customer_history" field as the customer's payment history.
+
+INVOICES:
+{invoices}
+"""
+
+SUMMARY_COUNTS = ("processed", "initial_sent", "followup_sent", "skipped")
+
+# Per-process agent, created on first use inside each worker
+_worker_agent = None
+
+
+def shard_for(customer_id: str, num_shards: int) -> int:
+    """Stable across processes and runs, unlike hash()"""
+    return zlib.crc32(customer_id.encode("utf-8")) % num_shards
+
+
+def partition_invoices(invoices: List[dict], num_shards: int) -> List[List[dict]]:
+    shards = [[] for _ in range(num_shards)]
+    for invoice in invoices:
+        shards[shard_for(invoice["customer_id"], num_shards)].append(invoice)
+    return shards
+
+
+def empty_summary() -> dict:
+    return {
+        "processed": 0,
+        "initial_sent": 0,
+        "followup_sent": 0,
+        "skipped": 0,
+        "skip_reasons": {},
+        "errors": []
+    }
+
+
+def merge_summaries(summaries: List[dict]) -> dict:
+    merged = empty_summary()
+    for summary in summaries:
+        for key in SUMMARY_COUNTS:
+            merged[key] += summary.get(key, 0)
+        for reason, count in summary.get("skip_reasons", {}).items():
+            merged["skip_reasons"][reason] = merged["skip_reasons"].get(reason, 0) + count
+        merged["errors"].extend(summary.get("errors", []))
+    merged["emails_sent"] = merged["initial_sent"] + merged["followup_sent"]
+    return merged
+
+
+def _get_worker_agent():
+    global _worker_agent
+    if _worker_agent is None:
+        from strands import Agent
+        from invoice_tools import send_personalized_email
+        from resilience import GuardedBedrockModel
+
+        _worker_agent = Agent(
+            model=GuardedBedrockModel(model_id="us.amazon.nova-lite-v1:0", temperature=0.1),
+            system_prompt=SHARD_AGENT_PROMPT,
+            tools=[send_personalized_email]
+        )
+    return _worker_agent
+
+
+def _customer_histories(ledger: List[dict]) -> Dict[str, dict]:
+    """History per customer from this shard's own rows"""
+    by_customer: Dict[str, List[dict]] = {}
+    for invoice in ledger:
+        by_customer.setdefault(invoice["customer_id"], []).append(invoice)
+    return {customer_id: customer_history_from(customer_id, rows)
+            for customer_id, rows in by_customer.items()}
+
+
+def _history_context(history: dict) -> str:
+    if not history.get("total_invoices"):
+        return ""
+    return f"risk {history['risk_level']}, payment rate {history['payment_rate']:.0%}"
+
+
+def _skip_reason(invoice: dict) -> str:
+    if invoice["email_sent"] and not invoice["is_overdue"]:
+        return "email already sent, not overdue"
+    return "not emailed by the agent"
+
+
+def _email_outcomes(messages: list) -> Dict[str, dict]:
+    """send_personalized_email results the agent actually got back, by invoice number"""
+    invoice_of = {}
+    outcomes: Dict[str, dict] = {}
+    for message in messages:
+        for block in message.get("content", []):
+            if "toolUse" in block and block["toolUse"]["name"] == "send_personalized_email":
+                use = block["toolUse"]
+                invoice_of[use["toolUseId"]] = (use.get("input") or {}).get("invoice_number")
+            elif "toolResult" in block and block["toolResult"]["toolUseId"] in invoice_of:
+                result = block["toolResult"]
+                parsed = parse_tool_result(result.get("content", []))
+                sent = result.get("status") != "error" and isinstance(parsed, dict) and parsed.get("success") is True
+                invoice_id = invoice_of[result["toolUseId"]]
+                # A retry that went through wins over an earlier failure
+                if sent or invoice_id not in outcomes:
+                    error = parsed.get("error") if isinstance(parsed, dict) else parsed
+                    outcomes[invoice_id] = {"sent": sent, "error": None if sent else str(error)}
+    return outcomes
+
+
+def _batch_summary(batch: List[dict], outcomes: Dict[str, dict], failure: Optional[str] = None) -> dict:
+    """Counts from the tool results, not from what the model says it did"""
+    summary = empty_summary()
+    summary["processed"] = len(batch)
+    for invoice in batch:
+        outcome = outcomes.get(invoice["invoice_id"])
+        if outcome is not None and outcome["sent"]:
+            summary["followup_sent" if invoice["email_sent"] else "initial_sent"] += 1
+        elif outcome is not None:
+            summary["errors"].append(f"{invoice['invoice_id']}: {outcome['error']}")
+        elif failure is not None:
+            summary["errors"].append(f"{invoice['invoice_id']}: agent failed: {failure}")
+        else:
+            summary["skipped"] += 1
+            reason = _skip_reason(invoice)
+            summary["skip_reasons"][reason] = summary["skip_reasons"].get(reason, 0) + 1
+    batch_ids = {invoice["invoice_id"] for invoice in batch}
+    for invoice_id in outcomes:
+        if invoice_id not in batch_ids:
+            summary["errors"].append(f"{invoice_id}: emailed by the agent but not in its batch")
+    return summary
+
+
+def _process_batch_with_agent(batch: List[dict], histories: Dict[str, dict]) -> dict:
+    agent = _get_worker_agent()
+    # Each batch is independent; don't carry the previous batch's turns
+    agent.messages = []
+    invoices = "\n".join(
+        json.dumps({
+            **{k: inv[k] for k in ("invoice_id", "customer_id", "customer_name", "amount",
+                                   "email_sent", "is_overdue", "days_overdue")},
+            "customer_history": _history_context(histories.get(inv["customer_id"], {}))
+        })
+        for inv in batch
+    )
+    failure = None
+    try:
+        agent(SHARD_TASK_PROMPT.format(invoices=invoices))
+    except Exception as e:
+        # Emails sent before the failure still count
+        failure = str(e)
+    return _batch_summary(batch, _email_outcomes(agent.messages), failure)
+
+
+def _process_shard_direct(invoices: List[dict], histories: Dict[str, dict]) -> dict:
+    """Apply the sweep rules straight against the tools, without model turns"""
+    from invoice_tools import send_personalized_email
+
+    summary = empty_summary()
+    for invoice in invoices:
+        summary["processed"] += 1
+        if not invoice["email_sent"]:
+            kind = "initial_sent"
+        elif invoice["is_overdue"]:
+            kind = "followup_sent"
+        else:
+            summary["skipped"] += 1
+            reason = _skip_reason(invoice)
+            summary["skip_reasons"][reason] = summary["skip_reasons"].get(reason, 0) + 1
+            continue
+
+        context = _history_context(histories.get(invoice["customer_id"], {}))
+        result = send_personalized_email(
+            customer_name=invoice["customer_name"],
+            invoice_number=invoice["invoice_id"],
+            amount=invoice["amount"],
+            days_overdue=invoice["days_overdue"],
+            customer_history=context
+        )
+        if result["success"]:
+            summary[kind] += 1
+        else:
+            summary["errors"].append(f"{invoice['invoice_id']}: {result['error']}")
+    return summary
+
+
+def process_shard(shard_id: int, ledger: List[dict], mode: str = "agent") -> dict:
+    """Worker entry point: process the sent invoices in one shard of the ledger"""
+    histories = _customer_histories(ledger)
+    invoices = [inv for inv in ledger if inv["status"] == "sent"]
+    if mode == "direct":
+        summary = _process_shard_direct(invoices, histories)
+    else:
+        summary = merge_summaries([
+            _process_batch_with_agent(invoices[i:i + AGENT_BATCH_SIZE], histories)
+            for i in range(0, len(invoices), AGENT_BATCH_SIZE)
+        ])
+    summary["shard_id"] = shard_id
+    summary["worker_pid"] = os.getpid()
+    return summary
+
+
+def run_sharded_sweep(workers: Optional[int] = None, num_shards: Optional[int] = None,
+                      mode: str = "agent") -> dict:
+    """Fetch the ledger once, fan the shards out to a process pool and merge the results"""
+    workers = workers or os.cpu_count() or 1
+    num_shards = num_shards or workers
+
+    ledger = list_all_invoices()
+    if not ledger["success"]:
+        summary = merge_summaries([])
+        summary["errors"].append(ledger["error"])
+        return summary
+
+    # Shards with no sent invoices have nothing to do
+    shards = [s for s in partition_invoices(ledger["all_invoices"], num_shards)
+              if any(inv["status"] == "sent" for inv in s)]
+    if workers == 1:
+        shard_summaries = [process_shard(i, shard, mode) for i, shard in enumerate(shards)]
+    else:
+        # spawn, so no worker inherits the parent's sockets or agent state
+        ctx = multiprocessing.get_context("spawn")
+        # Workers share one set of limiters, so N processes adapt a single limit per backend
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=install_limiters,
+                                 initargs=(share_limiters(ctx),)) as pool:
+            futures = [pool.submit(process_shard, i, shard, mode) for i, shard in enumerate(shards)]
+            shard_summaries = []
+            for i, future in enumerate(futures):
+                try:
+                    shard_summaries.append(future.result())
+                except Exception as e:
+                    failed = empty_summary()
+                    failed["shard_id"] = i
+                    failed["processed"] = sum(1 for inv in shards[i] if inv["status"] == "sent")
+                    failed["errors"] = [f"shard {i} crashed: {str(e)}"]
+                    shard_summaries.append(failed)
+
+    summary = merge_summaries(shard_summaries)
+    summary["shards"] = shard_summaries
+    return summary
+
+
+def format_report(summary: dict) -> str:
+    lines = [
+        "Sweep summary",
+        f"- Invoices processed: {summary['processed']}",
+        f"- Emails sent: {summary['emails_sent']} "
+        f"(initial: {summary['initial_sent']}, follow-up: {summary['followup_sent']})",
+        f"- Invoices skipped: {summary['skipped']}"
+    ]
+    for reason, count in summary["skip_reasons"].items():
+        lines.append(f"    - {reason}: {count}")
+    lines.append(f"- Errors: {len(summary['errors'])}")
+    for error in summary["errors"]:
+        lines.append(f"    - {error}")
+    if summary["errors"]:
+        lines.append("- Next recommended actions: re-run the sweep for the failed invoices")
+    else:
+        lines.append("- Next recommended actions: none, all sent invoices handled")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded sweep over all sent invoices")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shards", type=int, default=None)
+    parser.add_argument("--mode", choices=["agent", "direct"], default="agent")
+    args = parser.parse_args()
+
+    print(format_report(run_sharded_sweep(args.workers, args.shards, args.mode)))
@@ -0,0 +1,151 @@
+import os
+import time
+
+import pytest
+
+import invoice_tools
+import ledger_snapshot
+from ledger_snapshot import SnapshotCache, snapshot_path_for
+
+
+def invoice(invoice_id, status="sent", is_overdue=False):
+    return {"invoice_id": invoice_id, "customer_id": f"C-{invoice_id}", "customer_name": "Name",
+            "amount": 100.0, "status": status, "is_overdue": is_overdue, "days_overdue": 0,
+            "email_sent": False}
+
+
+ROWS = [invoice("INV-0", is_overdue=True), invoice("INV-1"), invoice("INV-2", status="paid")]
+SUMMARY = {"total": 3, "sent": 2, "paid": 1, "overdue": 1}
+
+
+@pytest.fixture
+def path(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir(mode=0o700)
+    return str(directory / "ledger.snap")
+
+
+def email_flags(cache):
+    return [row["email_sent"] for row in cache.get().rows()]
+
+
+def test_publish_is_refused_after_invalidate(path):
+    cache = SnapshotCache(path)
+    generation = cache.generation()
+    fetched_at = time.time()
+
+    cache.invalidate()
+
+    assert not cache.publish(ROWS, SUMMARY, generation, fetched_at)
+    assert not os.path.exists(path)
+    assert cache.get() is None
+
+
+def test_an_older_fetch_never_replaces_a_newer_file(path):
+    slow, fast = SnapshotCache(path), SnapshotCache(path)
+    generation = slow.generation()
+    slow_fetched_at = time.time()
+    newer = [dict(row, amount=200.0) for row in ROWS]
+
+    assert fast.publish(newer, SUMMARY, generation, time.time())
+    assert not slow.publish(ROWS, SUMMARY, generation, slow_fetched_at)
+
+    assert [row["amount"] for row in slow.get().rows()] == [200.0] * 3
+
+
+def test_patches_are_visible_after_another_cache_republishes(path):
+    first, second = SnapshotCache(path), SnapshotCache(path)
+    assert first.publish(ROWS, SUMMARY, first.generation(), time.time())
+    assert email_flags(first) == [False, False, False]
+
+    # Same rows, same version stamp, but a new file
+    second.invalidate()
+    assert second.publish(ROWS, SUMMARY, second.generation(), time.time())
+    second.mark_email_sent("INV-0")
+
+    assert email_flags(second) == [True, False, False]
+    assert email_flags(first) == [True, False, False]
+
+
+def test_snapshots_only_live_in_a_private_directory(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    cache = SnapshotCache(str(shared / "ledger.snap"))
+    cache.fetch = lambda: (ROWS, SUMMARY)
+
+    # Served straight from the fetch, nothing written next to other users' files
+    assert cache.load() == (ROWS, SUMMARY)
+    with pytest.raises(OSError):
+        cache.publish(ROWS, SUMMARY, 0, time.time())
+    assert os.listdir(shared) == []
+    assert cache.get() is None
+
+
+def test_snapshot_path_is_private_and_per_api(monkeypatch):
+    monkeypatch.delenv("LEDGER_SNAPSHOT_PATH", raising=False)
+    first = snapshot_path_for("https://api.example.com/dev")
+    second = snapshot_path_for("http://127.0.0.1:8080")
+
+    assert first != second
+    assert os.path.dirname(first) == ledger_snapshot.SNAPSHOT_DIR
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, rows, summary):
+        self.rows = rows
+        self.summary = summary
+
+    def json(self):
+        return {"summary": self.summary, "invoices": [
+            {"invoiceId": row["invoice_id"], "customerId": row["customer_id"], "name": row["customer_name"],
+             "email": "x@example.com", "companyName": "Co", "amount": row["amount"],
+             "status": row["status"], "dueDate": "2026-01-01", "createdAt": "2025-12-01",
+             "isOverdue": row["is_overdue"]}
+            for row in self.rows
+        ]}
+
+
+@pytest.fixture
+def api(path, monkeypatch):
+    requests = []
+
+    def request_invoices(status_filter=None):
+        requests.append(status_filter)
+        rows = [row for row in ROWS if status_filter is None or row["status"] == status_filter]
+        return FakeResponse(rows, {"api_total": len(rows)} if status_filter else SUMMARY)
+
+    cache = SnapshotCache(path)
+    cache.fetch = invoice_tools._fetch_ledger
+    monkeypatch.setattr(invoice_tools, "ledger_cache", cache)
+    monkeypatch.setattr(invoice_tools, "_request_invoices", request_invoices)
+    monkeypatch.setattr(cache, "refresh_async", lambda: None)
+    return cache, requests
+
+
+def test_filtered_miss_asks_the_api_for_its_summary(api):
+    cache, requests = api
+
+    result = invoice_tools.list_all_invoices("sent")
+
+    assert requests == ["sent"]
+    assert result["summary"] == {"api_total": 2}
+    assert [inv["invoice_id"] for inv in result["all_invoices"]] == ["INV-0", "INV-1"]
+
+
+def test_filtered_hit_recounts_the_api_summary_keys(api):
+    cache, requests = api
+    assert cache.publish(ROWS, SUMMARY, cache.generation(), time.time())
+
+    result = invoice_tools.list_all_invoices("sent")
+
+    assert requests == []
+    assert result["summary"] == {"total": 2, "sent": 2, "paid": 0, "overdue": 1}
+
+    # A key the rows can't reproduce goes back to the API
+    cache.invalidate()
+    assert cache.publish(ROWS, dict(SUMMARY, outstanding=300.0), cache.generation(), time.time())
+    assert invoice_tools.list_all_invoices("sent")["summary"] == {"api_total": 2}
+    assert requests == ["sent"]
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+import payment_scoring
+from payment_scoring import build_features, ledger_from_rows, score_ledger
+
+TODAY = np.datetime64("2026-06-30", "D")
+
+
+def invoice(invoice_id, customer_id, status, due_date, amount=100.0, days_overdue=0,
+            created_at="2026-01-01T00:00:00"):
+    return {
+        "invoice_id": invoice_id,
+        "customer_id": customer_id,
+        "status": status,
+        "amount": amount,
+        "days_overdue": days_overdue,
+        "due_date": due_date,
+        "created_at": created_at,
+    }
+
+
+@pytest.fixture
+def rows():
+    return [
+        invoice("A-1", "A", "paid", "2026-06-20", amount=100.0),
+        invoice("A-2", "A", "paid", "2026-05-31", amount=300.0),
+        invoice("A-3", "A", "sent", "2026-06-10", amount=600.0, days_overdue=20),
+        invoice("B-1", "B", "sent", "2026-05-01", amount=50.0, days_overdue=60),
+        invoice("B-2", "B", "sent", "2026-07-30", amount=50.0),
+        invoice("C-1", "C", "paid", "2026-04-01", amount=10.0),
+    ]
+
+
+def test_customer_aggregates(rows):
+    ledger = ledger_from_rows(rows)
+    _, customers, _ = build_features(ledger, TODAY)
+    a, b, c = (ledger["customer_ids"].index(x) for x in "ABC")
+
+    assert customers["invoices"][[a, b, c]].tolist() == [3, 2, 1]
+    assert customers["paid_rate"][[a, b, c]] == pytest.approx([2 / 3, 0.0, 1.0])
+    # Mean lateness over each customer's open invoices
+    assert customers["avg_days_late"][[a, b, c]] == pytest.approx([20.0, 30.0, 0.0])
+    # Most recent paid due date; never-paid customers are capped
+    assert customers["days_since_last_payment"][[a, b, c]].tolist() == [
+        10.0, payment_scoring.NO_PAYMENT_DAYS, 90.0
+    ]
+
+
+def test_amount_group_bys(rows):
+    ledger = ledger_from_rows(rows)
+    X, _, _ = build_features(ledger, TODAY)
+    concentration = X[:, payment_scoring.FEATURES.index("amount_concentration")]
+    share = X[:, payment_scoring.FEATURES.index("amount_share")]
+
+    assert share[:3] == pytest.approx([0.1, 0.3, 0.6])
+    assert concentration[:3] == pytest.approx([0.46] * 3)
+    assert share[5] == pytest.approx(1.0)
+
+
+def test_leave_one_out_excludes_own_outcome(rows):
+    ledger = ledger_from_rows(rows)
+    X, _, avg_late = build_features(ledger, TODAY)
+    paid_rate = X[:, payment_scoring.FEATURES.index("paid_rate")]
+    months_since = X[:, payment_scoring.FEATURES.index("months_since_last_payment")]
+
+    # A-1 sees A-2 paid and A-3 open: (1 + 1) / (2 + 2); A-3 sees both paid: (2 + 1) / (2 + 2)
+    assert paid_rate[:3] == pytest.approx([0.5, 0.5, 0.75])
+    # A single-invoice customer has no other history and sits at the prior
+    assert paid_rate[5] == pytest.approx(0.5)
+    # A-1 is A's latest payment, so it falls back to A-2; the others see A-1
+    assert months_since[:3] * 30 == pytest.approx([30.0, 10.0, 10.0])
+    assert months_since[5] * 30 == pytest.approx(payment_scoring.NO_PAYMENT_DAYS)
+    # Lateness of the customer's other invoices only
+    assert avg_late[:3] == pytest.approx([10.0, 10.0, 0.0])
+    assert avg_late[3:5] == pytest.approx([0.0, 60.0])
+
+
+def test_pay_date_accounts_for_days_overdue(rows):
+    ledger = ledger_from_rows(rows)
+    scores = score_ledger(ledger, TODAY)
+    pay_date = dict(zip((ledger["invoice_ids"][i] for i in scores["open_idx"]), scores["pay_date"]))
+
+    assert all(date >= TODAY for date in pay_date.values())
+    # Already 60 days late: not expected to clear today
+    assert pay_date["B-1"] > TODAY
+    # Not due yet: not expected before its due date
+    assert pay_date["B-2"] >= np.datetime64("2026-07-30")
+
+
+def test_pay_date_grows_with_days_overdue():
+    # Identical customers, so only the open invoice's own lateness differs
+    rows = []
+    for customer, due, days_overdue in (("A", "2026-06-29", 1), ("B", "2026-04-01", 90),
+                                        ("C", "2025-12-30", 182)):
+        rows.append(invoice(f"{customer}-1", customer, "paid", "2026-03-01"))
+        rows.append(invoice(f"{customer}-2", customer, "sent", due, days_overdue=days_overdue))
+    scores = score_ledger(ledger_from_rows(rows), TODAY)
+
+    assert np.all(np.diff(scores["pay_date"].astype(np.int64)) > 0)
+
+
+def test_empty_ledger():
+    scores = score_ledger(ledger_from_rows([]), TODAY)
+
+    assert len(scores["probability"]) == 0
+    assert len(scores["pay_date"]) == 0
+    assert scores["model"] is None
+
+
+def test_row_path_scores_are_cached(rows, monkeypatch):
+    monkeypatch.setattr(payment_scoring.ledger_cache, "get", lambda: None)
+    monkeypatch.setattr(payment_scoring, "list_all_invoices",
+                        lambda: {"success": True, "all_invoices": rows})
+    monkeypatch.setattr(payment_scoring, "_scores_cache", {})
+    fits = []
+    monkeypatch.setattr(payment_scoring, "score_ledger",
+                        lambda ledger: fits.append(ledger) or score_ledger(ledger, TODAY))
+
+    first = payment_scoring.score_payment_propensity(customer_id="B")
+    second = payment_scoring.score_payment_propensity(customer_id="B")
+
+    assert first["success"] and first == second
+    assert len(fits) == 1
@@ -0,0 +1,193 @@
+import os
+import re
+import stat
+
+import pytest
+
+import plan_cache
+from plan_cache import (
+    READ_ONLY_TOOLS,
+    PlanCache,
+    build_plan,
+    extract_tool_calls,
+    run_with_plan_cache,
+    task_signature,
+)
+
+
+class Ledger:
+    """Tool stand-ins over an in-memory ledger, logging every email sent"""
+
+    def __init__(self):
+        self.invoices = {
+            "INV-1": {"invoice_id": "INV-1", "customer_id": "CUST-A", "customer_name": "Alice",
+                      "amount": 100.0, "status": "sent", "email_sent": False, "is_overdue": True,
+                      "days_overdue": 3},
+            "INV-2": {"invoice_id": "INV-2", "customer_id": "CUST-B", "customer_name": "Bob",
+                      "amount": 250.0, "status": "sent", "email_sent": False, "is_overdue": True,
+                      "days_overdue": 9},
+            "INV-3": {"invoice_id": "INV-3", "customer_id": "CUST-C", "customer_name": "Carol",
+                      "amount": 75.0, "status": "sent", "email_sent": False, "is_overdue": False,
+                      "days_overdue": 0},
+        }
+        self.sent = []
+
+        def get_invoice_details(invoice_id):
+            return {"success": True, **self.invoices[invoice_id]}
+
+        def list_all_invoices(status_filter=None):
+            rows = [dict(inv) for inv in self.invoices.values()
+                    if status_filter is None or inv["status"] == status_filter]
+            return {"success": True, "total_invoices": len(rows), "all_invoices": rows}
+
+        def get_customer_invoice_history(customer_id):
+            rows = [inv for inv in self.invoices.values() if inv["customer_id"] == customer_id]
+            return {"success": True, "customer_id": customer_id, "total_invoices": len(rows),
+                    "risk_level": "HIGH"}
+
+        def send_personalized_email(customer_name, invoice_number, amount, days_overdue,
+                                    customer_history="", ai_generated_content=None):
+            self.sent.append({"customer_name": customer_name, "invoice_number": invoice_number,
+                              "customer_history": customer_history,
+                              "ai_generated_content": ai_generated_content})
+            self.invoices[invoice_number]["email_sent"] = True
+            return {"success": True, "invoice_number": invoice_number}
+
+        self.tools = [get_invoice_details, list_all_invoices, get_customer_invoice_history,
+                      send_personalized_email]
+
+
+class ScriptedAgent:
+    """Stands in for a strands Agent: runs a script and records Bedrock-format messages"""
+
+    def __init__(self, tools, script):
+        self.tools = {t.__name__: t for t in tools}
+        self.script = script
+        self.messages = []
+        self.tasks = []
+
+    def __call__(self, task):
+        self.tasks.append(task)
+        self.messages.append({"role": "user", "content": [{"text": task}]})
+        return self.script(self, task)
+
+    def call(self, name, **kwargs):
+        use_id = f"tooluse_{len(self.messages)}"
+        self.messages.append({"role": "assistant", "content": [
+            {"toolUse": {"toolUseId": use_id, "name": name, "input": kwargs}}
+        ]})
+        result = self.tools[name](**kwargs)
+        self.messages.append({"role": "user", "content": [
+            {"toolResult": {"toolUseId": use_id, "status": "success", "content": [{"text": str(result)}]}}
+        ]})
+        return result
+
+
+def remind(agent, task):
+    invoice_id = re.search(r"INV-\d+", task).group(0)
+    invoice = agent.call("get_invoice_details", invoice_id=invoice_id)
+    history = agent.call("get_customer_invoice_history", customer_id=invoice["customer_id"])
+    name = invoice["customer_name"]
+    agent.call("send_personalized_email", customer_name=name, invoice_number=invoice_id,
+               amount=invoice["amount"], days_overdue=invoice["days_overdue"],
+               customer_history=f"{name}: risk {history['risk_level']}",
+               ai_generated_content={"subject": f"{name}, {invoice_id} is late",
+                                     "body": f"Dear {name} ..."})
+    return "Summary: processed 1, sent 1, skipped 0, errors 0"
+
+
+def sweep(agent, task):
+    invoices = agent.call("list_all_invoices", status_filter="sent")["all_invoices"]
+    sent = 0
+    for invoice in invoices:
+        if invoice["email_sent"] and not invoice["is_overdue"]:
+            continue
+        agent.call("get_customer_invoice_history", customer_id=invoice["customer_id"])
+        agent.call("send_personalized_email", customer_name=invoice["customer_name"],
+                   invoice_number=invoice["invoice_id"], amount=invoice["amount"],
+                   days_overdue=invoice["days_overdue"],
+                   ai_generated_content={"subject": "Reminder", "body": invoice["customer_name"]})
+        sent += 1
+    return f"Summary: processed {len(invoices)}, sent {sent}, skipped {len(invoices) - sent}, errors 0"
+
+
+SWEEP_TASK = 'Process all invoices with status "sent" and send emails based on the rules'
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = PlanCache(str(tmp_path / "plans" / "plans.json"))
+    monkeypatch.setattr(plan_cache, "plan_cache", cache)
+    return cache
+
+
+def test_sends_are_never_replayed_with_another_runs_content(cache):
+    ledger = Ledger()
+    run_with_plan_cache(ScriptedAgent(ledger.tools, remind),
+                        "Send a reminder email for invoice INV-1", ledger.tools)
+    signature, _ = task_signature("Send a reminder email for invoice INV-2",
+                                  [t.__name__ for t in ledger.tools])
+    plan = cache.get(signature)
+    assert plan is not None
+    assert {step["tool"] for step in plan["steps"]} <= READ_ONLY_TOOLS
+
+    agent = ScriptedAgent(ledger.tools, remind)
+    response = run_with_plan_cache(agent, "Send a reminder email for invoice INV-2", ledger.tools)
+
+    # The model still writes the reply and the email; the prefetched lookups are for INV-2
+    assert response.startswith("Summary:")
+    assert '"invoice_id": "INV-2"' in agent.tasks[0] and "Alice" not in agent.tasks[0]
+    assert [email["customer_name"] for email in ledger.sent] == ["Alice", "Bob"]
+    assert ledger.sent[1]["ai_generated_content"]["subject"] == "Bob, INV-2 is late"
+
+
+def test_selection_is_not_replayed_when_nothing_needs_an_email(cache):
+    ledger = Ledger()
+    run_with_plan_cache(ScriptedAgent(ledger.tools, sweep), SWEEP_TASK, ledger.tools)
+    assert len(ledger.sent) == 3
+    for invoice in ledger.invoices.values():
+        invoice["is_overdue"] = False
+
+    response = run_with_plan_cache(ScriptedAgent(ledger.tools, sweep), SWEEP_TASK, ledger.tools)
+
+    assert len(ledger.sent) == 3
+    assert "sent 0" in response
+
+
+def test_string_literals_must_come_from_the_task():
+    ledger = Ledger()
+    tools = {t.__name__: t for t in ledger.tools}
+    calls = [{"tool": "get_customer_invoice_history", "input": {"customer_id": "CUST-A"},
+              "result": {"success": True}}]
+
+    assert build_plan(calls, [], tools, "Summarize the riskiest customer") is None
+    assert build_plan(calls, [], tools, "Summarize customer CUST-A") is not None
+
+
+def test_failed_tool_results_are_not_recorded():
+    ledger = Ledger()
+    agent = ScriptedAgent(ledger.tools, remind)
+    agent("Send a reminder email for invoice INV-1")
+    assert extract_tool_calls(agent.messages) is not None
+
+    agent.messages[-1]["content"][0]["toolResult"]["content"] = [
+        {"text": str({"success": False, "error": "Failed to send email: 500"})}
+    ]
+    assert extract_tool_calls(agent.messages) is None
+
+
+def test_plans_persist_only_in_a_private_directory(tmp_path):
+    private = PlanCache(str(tmp_path / "private" / "plans.json"))
+    private.put("sig", {"steps": []})
+    mode = stat.S_IMODE(os.stat(private.path).st_mode)
+    assert mode & 0o077 == 0
+    assert PlanCache(private.path).get("sig") == {"steps": []}
+
+    shared_dir = tmp_path / "shared"
+    shared_dir.mkdir()
+    shared_dir.chmod(0o777)
+    shared = PlanCache(str(shared_dir / "plans.json"))
+    shared.put("sig", {"steps": []})
+    assert not os.path.exists(shared.path)
+    # Kept in memory for this process
+    assert shared.get("sig") == {"steps": []}
@@ -0,0 +1,117 @@
+import asyncio
+import multiprocessing
+
+import pytest
+from botocore.exceptions import ClientError
+from strands.models import BedrockModel
+from strands.types.exceptions import ModelThrottledException
+
+import resilience
+from resilience import AdaptiveLimiter, Backend, BackendUnavailable, CircuitBreaker, GuardedBedrockModel
+
+
+def test_stale_success_does_not_close_an_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60.0)
+    stale = breaker.before_call()
+    for _ in range(3):
+        breaker.record(breaker.before_call(), False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.record(stale, True)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_only_the_probe_decides_a_half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.0)
+    stale = breaker.before_call()
+    breaker.record(breaker.before_call(), False)
+    probe = breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record(stale, True)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # The stale result did not clear the probe slot
+    with pytest.raises(BackendUnavailable):
+        breaker.before_call()
+
+    breaker.record(probe, True)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_burst_of_overloads_halves_the_limit_once():
+    limiter = AdaptiveLimiter(initial_limit=32, max_limit=32)
+    burst = [limiter.acquire() for _ in range(8)]
+    for started in burst:
+        limiter.release(started, True)
+    assert limiter.limit == 16
+
+    # A request started after the cut belongs to the next window
+    limiter.release(limiter.acquire(), True)
+    assert limiter.limit == 8
+    assert limiter.in_flight == 0
+
+
+def _overload_once(limiter):
+    limiter.release(limiter.acquire(), True)
+
+
+def test_shared_limiter_adapts_across_processes():
+    ctx = multiprocessing.get_context("spawn")
+    limiter = AdaptiveLimiter(initial_limit=8, max_limit=8).shared(ctx)
+    worker = ctx.Process(target=_overload_once, args=(limiter,))
+    worker.start()
+    worker.join(timeout=60)
+
+    assert worker.exitcode == 0
+    assert limiter.limit == 4
+
+
+def _guarded_model(monkeypatch, error):
+    async def stream(self, *args, **kwargs):
+        if error is not None:
+            raise error
+        yield {"contentBlockDelta": {"delta": {"text": "ok"}}}
+
+    monkeypatch.setattr(BedrockModel, "stream", stream, raising=False)
+    backend = Backend("bedrock", limiter=AdaptiveLimiter(initial_limit=4),
+                      breaker=CircuitBreaker(failure_threshold=1))
+    monkeypatch.setattr(resilience, "bedrock", backend)
+    return GuardedBedrockModel.__new__(GuardedBedrockModel), backend
+
+
+def _drain(model):
+    async def run():
+        return [event async for event in model.stream([])]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("error", [
+    ClientError({"Error": {"Code": "ValidationException"},
+                 "ResponseMetadata": {"HTTPStatusCode": 400}}, "ConverseStream"),
+    ValueError("input is too long for requested model"),
+])
+def test_client_errors_leave_the_bedrock_guard_healthy(monkeypatch, error):
+    model, backend = _guarded_model(monkeypatch, error)
+
+    with pytest.raises(type(error)):
+        _drain(model)
+
+    assert backend.breaker.state == CircuitBreaker.CLOSED
+    # Counted as a healthy call, so the limit grows rather than halves
+    assert backend.limiter.limit > 4
+
+
+@pytest.mark.parametrize("error", [
+    ModelThrottledException("Too many requests"),
+    ClientError({"Error": {"Code": "ServiceUnavailableException"},
+                 "ResponseMetadata": {"HTTPStatusCode": 503}}, "ConverseStream"),
+])
+def test_throttling_and_server_errors_count_as_overload(monkeypatch, error):
+    model, backend = _guarded_model(monkeypatch, error)
+
+    with pytest.raises(type(error)):
+        _drain(model)
+
+    assert backend.breaker.state == CircuitBreaker.OPEN
+    assert backend.limiter.limit == 2
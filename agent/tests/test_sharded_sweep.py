@@ -0,0 +1,144 @@
+import pytest
+
+import invoice_tools
+import sharded_sweep
+from invoice_tools import customer_history_from
+from sharded_sweep import merge_summaries, partition_invoices, process_shard, shard_for
+
+
+def invoice(invoice_id, customer_id, status="sent", email_sent=False, is_overdue=False, days_overdue=0):
+    return {
+        "invoice_id": invoice_id,
+        "customer_id": customer_id,
+        "customer_name": f"Name {customer_id}",
+        "customer_email": f"{customer_id}@example.com",
+        "company_name": f"Company {customer_id}",
+        "amount": 100.0,
+        "currency": "MYR",
+        "status": status,
+        "email_sent": email_sent,
+        "is_overdue": is_overdue,
+        "days_overdue": days_overdue,
+    }
+
+
+@pytest.fixture
+def ledger():
+    rows = []
+    for c in range(12):
+        customer_id = f"CUST-{c:03d}"
+        rows.append(invoice(f"INV-{c:03d}-0", customer_id, status="paid", email_sent=True))
+        rows.append(invoice(f"INV-{c:03d}-1", customer_id, status="paid", email_sent=True))
+        rows.append(invoice(f"INV-{c:03d}-2", customer_id, email_sent=c % 2 == 0,
+                            is_overdue=c % 3 == 0, days_overdue=10 if c % 3 == 0 else 0))
+    return rows
+
+
+@pytest.fixture
+def sent_emails(monkeypatch):
+    sent = []
+
+    def send_personalized_email(customer_name, invoice_number, amount, days_overdue,
+                                customer_history="", ai_generated_content=None):
+        sent.append({"invoice_number": invoice_number, "customer_history": customer_history})
+        return {"success": True, "invoice_number": invoice_number}
+
+    def no_download(*args, **kwargs):
+        raise AssertionError("shards must not fetch the ledger")
+
+    monkeypatch.setattr(invoice_tools, "send_personalized_email", send_personalized_email)
+    monkeypatch.setattr(invoice_tools, "list_all_invoices", no_download)
+    monkeypatch.setattr(invoice_tools, "get_customer_invoice_history", no_download)
+    return sent
+
+
+def test_partition_keeps_each_customer_on_one_shard(ledger):
+    shards = partition_invoices(ledger, 4)
+
+    assert sorted(inv["invoice_id"] for shard in shards for inv in shard) == \
+        sorted(inv["invoice_id"] for inv in ledger)
+    for n, shard in enumerate(shards):
+        assert all(shard_for(inv["customer_id"], 4) == n for inv in shard)
+
+
+def test_direct_shard_uses_local_history(ledger, sent_emails):
+    shard = partition_invoices(ledger, 3)[0]
+    summary = process_shard(0, shard, mode="direct")
+
+    sent = [inv for inv in shard if inv["status"] == "sent"]
+    due = [inv for inv in sent if not inv["email_sent"] or inv["is_overdue"]]
+    assert summary["processed"] == len(sent)
+    assert summary["initial_sent"] + summary["followup_sent"] == len(due)
+    assert summary["skipped"] == len(sent) - len(due)
+    # Two paid invoices out of three for every customer
+    history = customer_history_from(due[0]["customer_id"],
+                                    [inv for inv in ledger if inv["customer_id"] == due[0]["customer_id"]])
+    assert history["payment_rate"] == pytest.approx(2 / 3)
+    assert {email["customer_history"] for email in sent_emails} == {"risk HIGH, payment rate 67%"}
+
+
+class FakeAgent:
+    """Sends the given invoices through tool messages, then claims whatever it likes"""
+
+    def __init__(self, sends, raise_after=None):
+        self.sends = sends
+        self.raise_after = raise_after
+        self.messages = []
+
+    def __call__(self, task):
+        for n, (invoice_id, result) in enumerate(self.sends):
+            self.messages.append({"role": "assistant", "content": [{"toolUse": {
+                "toolUseId": f"t{n}", "name": "send_personalized_email",
+                "input": {"invoice_number": invoice_id}}}]})
+            self.messages.append({"role": "user", "content": [{"toolResult": {
+                "toolUseId": f"t{n}", "status": "success", "content": [{"text": str(result)}]}}]})
+        if self.raise_after is not None:
+            raise RuntimeError(self.raise_after)
+        return 'SUMMARY_JSON: {"processed": 99, "initial_sent": 50, "errors": "none"}'
+
+
+def test_agent_batch_counts_come_from_tool_results(monkeypatch):
+    batch = [
+        invoice("INV-1", "A", email_sent=False),
+        invoice("INV-2", "B", email_sent=True, is_overdue=True, days_overdue=9),
+        invoice("INV-3", "C", email_sent=True),
+        invoice("INV-4", "D", email_sent=False),
+    ]
+    agent = FakeAgent([
+        ("INV-1", {"success": True}),
+        ("INV-2", {"success": True}),
+        ("INV-4", {"success": False, "error": "Failed to send email: 500"}),
+    ])
+    monkeypatch.setattr(sharded_sweep, "_get_worker_agent", lambda: agent)
+
+    summary = sharded_sweep._process_batch_with_agent(batch, {})
+
+    assert summary["processed"] == 4
+    assert (summary["initial_sent"], summary["followup_sent"], summary["skipped"]) == (1, 1, 1)
+    assert summary["skip_reasons"] == {"email already sent, not overdue": 1}
+    assert summary["errors"] == ["INV-4: Failed to send email: 500"]
+
+
+def test_agent_failure_keeps_emails_already_sent(monkeypatch):
+    batch = [invoice("INV-1", "A"), invoice("INV-2", "B")]
+    agent = FakeAgent([("INV-1", {"success": True})], raise_after="throttled")
+    monkeypatch.setattr(sharded_sweep, "_get_worker_agent", lambda: agent)
+
+    summary = sharded_sweep._process_batch_with_agent(batch, {})
+
+    assert summary["initial_sent"] == 1
+    assert summary["errors"] == ["INV-2: agent failed: throttled"]
+
+
+def test_merge_summaries_adds_counts_and_reasons():
+    first = sharded_sweep.empty_summary()
+    first.update(processed=3, initial_sent=1, skipped=2, skip_reasons={"x": 2}, errors=["e1"])
+    second = sharded_sweep.empty_summary()
+    second.update(processed=2, followup_sent=1, skipped=1, skip_reasons={"x": 1}, errors=["e2"])
+
+    merged = merge_summaries([first, second])
+
+    assert merged["processed"] == 5
+    assert merged["emails_sent"] == 2
+    assert merged["skip_reasons"] == {"x": 3}
+    assert merged["errors"] == ["e1", "e2"]